@@ -0,0 +1,287 @@
+###############################################################################
+#  Benchmarks for the Simple Pascal Interpreter.                              #
+#                                                                             #
+#  Run a benchmark with $ python benchmarks.py tokens                        #
+#                                                                             #
+###############################################################################
+import argparse
+import time
+import tracemalloc
+
+from spi import (
+    AST, HashConsingParser, IncrementalParser, Interpreter, IterativeParser,
+    LazyParser, Parser, RegexLexer, SemanticAnalyzer, TokenType, TypeChecker,
+    flatten, parse_parallel,
+)
+
+
+def generate_program(procedures=200, statements=20):
+    """Return the text of a large machine-generated Pascal program."""
+    lines = [
+        'PROGRAM Generated;',
+        'VAR',
+        '   x, y : INTEGER;',
+        '   z    : REAL;',
+    ]
+    for i in range(procedures):
+        lines.extend([
+            f'PROCEDURE P{i}(a : INTEGER; b : REAL);',
+            'VAR',
+            '   k, m : INTEGER;',
+            '   r    : REAL;',
+            f'BEGIN {{ P{i} }}',
+        ])
+        body = []
+        for j in range(statements):
+            body.append(f'   k := (a + {j}) * 2 - a DIV 3')
+            body.append(f'   r := b / {j + 1}.5 + k * (a - {j})')
+        lines.append(';\n'.join(body))
+        lines.append(f'END;  {{ P{i} }}')
+
+    lines.append('BEGIN { Generated }')
+    body = ['   x := 1', '   y := 2', '   z := 0.5']
+    for i in range(procedures):
+        body.append(f'   P{i}(x + {i}, z * y)')
+    lines.append(';\n'.join(body))
+    lines.append('END.  { Generated }')
+    return '\n'.join(lines) + '\n'
+
+
+def generate_calls(depth=20, calls=100):
+    """Return the text of a program that keeps `depth` procedures, each
+    one declared in the previous one, on the call stack `calls` times."""
+    lines = ['PROGRAM Calls;']
+    for i in range(depth):
+        lines.extend([
+            f'PROCEDURE P{i}(a : INTEGER);',
+            'VAR k, m : INTEGER;',
+        ])
+    for i in reversed(range(depth)):
+        call = f'; P{i + 1}(a + 1)' if i + 1 < depth else ''
+        lines.append(f'BEGIN k := a; m := k * 2{call} END;  {{ P{i} }}')
+    body = [f'   P0({i})' for i in range(calls)]
+    lines.append('BEGIN { Calls }')
+    lines.append(';\n'.join(body))
+    lines.append('END.  { Calls }')
+    return '\n'.join(lines) + '\n'
+
+
+def generate_nested(depth=25, statements=200):
+    """Return the text of a program with `depth` nested procedures whose
+    statements use the global variables."""
+    lines = ['PROGRAM Nested;', 'VAR g0, g1, g2, g3 : INTEGER;']
+    for i in range(depth):
+        lines.extend([
+            f'PROCEDURE P{i}(a : INTEGER);',
+            'VAR k : INTEGER;',
+        ])
+    body = ';\n'.join(
+        f'   g{j % 4} := g{(j + 1) % 4} + a * g{(j + 2) % 4} - k'
+        for j in range(statements)
+    )
+    for i in reversed(range(depth)):
+        lines.append(f'BEGIN {{ P{i} }}\n{body}\nEND;  {{ P{i} }}')
+    lines.append('BEGIN { Nested }\n   P0(1)\nEND.  { Nested }')
+    return '\n'.join(lines) + '\n'
+
+
+def timed(func, repeat=5):
+    """Return the best wall-clock time of `repeat` calls of func()."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def traced(build):
+    """Return the result of build() and the memory it holds on to."""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = build()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return result, after - before
+
+
+def iter_tokens(token_source):
+    while True:
+        token = token_source.get_next_token()
+        if token.type == TokenType.EOF:
+            return
+        yield token
+
+
+class DictToken:
+    """The token layout before __slots__: an instance dict holding
+    eagerly computed line and column numbers."""
+    def __init__(self, type, value, lineno, column):
+        self.type = type
+        self.value = value
+        self.lineno = lineno
+        self.column = column
+
+
+def bench_tokens(text):
+    """Per-token memory of the different token representations."""
+    def buffer_and_flyweight_tokens():
+        buffer = RegexLexer(text).tokenize()
+        return buffer, list(iter_tokens(buffer.reader()))
+
+    variants = (
+        ('Token with __dict__, eager positions', lambda: [
+            DictToken(token.type, token.value, *token.position())
+            for token in iter_tokens(RegexLexer(text))
+        ]),
+        ('slotted Token, lazy positions', lambda: list(
+            iter_tokens(RegexLexer(text))
+        )),
+        ('TokenBuffer', lambda: RegexLexer(text).tokenize()),
+        ('TokenBuffer + flyweight tokens', buffer_and_flyweight_tokens),
+    )
+    count = len(RegexLexer(text).tokenize())
+    print(f'{count} tokens')
+    for name, build in variants:
+        _, size = traced(build)
+        print(f'{name:<40}: {size / count:6.1f} bytes/token')
+
+
+def bench_parse(text):
+    """Parse time of a pre-lexed program (lexing is not measured)."""
+    buffer = RegexLexer(text).tokenize()
+    print(f'{len(buffer)} tokens')
+    for parser_class in (Parser, IterativeParser, LazyParser):
+        seconds = timed(lambda: parser_class(buffer.reader()).parse())
+        name = f'{parser_class.__name__}.parse'
+        print(f'{name:<40}: {seconds * 1000:8.1f} ms')
+    seconds = timed(lambda: parse_parallel(buffer.reader()))
+    print(f'{"parse_parallel":<40}: {seconds * 1000:8.1f} ms')
+
+
+def bench_edit(text):
+    """Reparse time after a one-character edit in a procedure body."""
+    parser = IncrementalParser(text)
+    seconds = timed(parser.parse, repeat=1)
+    print(f'{"IncrementalParser.parse":<40}: {seconds * 1000:8.1f} ms')
+
+    # flip an operator in the middle of the program back and forth
+    offset = text.index('2 - a DIV 3', len(text) // 2) + len('2 ')
+    operators = iter('+-' * 10)
+    seconds = timed(lambda: parser.edit(offset, 1, next(operators)), repeat=20)
+    print(f'{"IncrementalParser.edit":<40}: {seconds * 1000:8.1f} ms')
+
+
+def count_nodes(tree):
+    """Return the number of AST nodes in the tree."""
+    count = 0
+    nodes = [tree]
+    while nodes:
+        node = nodes.pop()
+        count += 1
+        for name in dir(node):
+            value = getattr(node, name, None)
+            if isinstance(value, AST):
+                nodes.append(value)
+            elif isinstance(value, list):
+                nodes.extend(item for item in value if isinstance(item, AST))
+    return count
+
+
+def bench_ast(text):
+    """Memory held by the AST of a program (and the tokens in it)."""
+    buffer = RegexLexer(text).tokenize()
+    tree, size = traced(lambda: Parser(buffer.reader()).parse())
+    count = count_nodes(tree)
+    print(f'{count} nodes')
+    print(f'{"AST":<40}: {size / 1024:8.1f} KiB')
+    print(f'{"AST":<40}: {size / count:8.1f} bytes/node')
+    shared, size = traced(lambda: HashConsingParser(buffer.reader()).parse())
+    print(f'{"AST, hash-consed":<40}: {size / 1024:8.1f} KiB')
+    print(f'{"AST, hash-consed":<40}: {size / count:8.1f} bytes/node')
+    flat, size = traced(lambda: flatten(shared))
+    print(f'{"FlatTree, hash-consed":<40}: {size / 1024:8.1f} KiB')
+    flat, size = traced(lambda: flatten(tree))
+    print(f'{"FlatTree":<40}: {size / 1024:8.1f} KiB')
+    print(f'{"FlatTree":<40}: {size / count:8.1f} bytes/node')
+    print(f'{"FlatTree.tobytes":<40}: {len(flat.tobytes()) / 1024:8.1f} KiB')
+
+
+def bench_analyze(text):
+    """Analysis time of deeply nested procedures that use globals.
+
+    The generated program of the other benchmarks is not used.
+    """
+    depth = 25
+    tree = Parser(RegexLexer(generate_nested(depth))).parse()
+    seconds = timed(lambda: SemanticAnalyzer().visit(tree))
+    name = f'SemanticAnalyzer.visit ({depth} levels)'
+    print(f'{name:<40}: {seconds * 1000:8.1f} ms')
+
+
+def bench_interpret(text):
+    """Run time of an analyzed program (parsing is not measured)."""
+    for analyzer_class in (SemanticAnalyzer, TypeChecker):
+        tree = Parser(RegexLexer(text)).parse()
+        analyzer_class().visit(tree)
+        seconds = timed(Interpreter(tree).interpret)
+        name = f'Interpreter.interpret ({analyzer_class.__name__})'
+        print(f'{name:<40}: {seconds * 1000:8.1f} ms')
+
+
+class EagerLogInterpreter(Interpreter):
+    """The logging before lazy formatting: messages, and the call stack,
+    are formatted even when they are not printed."""
+    def log(self, msg, *args):
+        super().log(msg.format(*args) if args else str(msg))
+
+
+def bench_calls(text):
+    """Run time of nested procedure calls, with logging turned off.
+
+    The generated program of the other benchmarks is not used.
+    """
+    depth, calls = 20, 100
+    tree = Parser(RegexLexer(generate_calls(depth, calls))).parse()
+    SemanticAnalyzer().visit(tree)
+    print(f'{depth * calls} calls')
+    for name, interpreter_class in (
+        ('Interpreter, eager log formatting', EagerLogInterpreter),
+        ('Interpreter', Interpreter),
+    ):
+        seconds = timed(interpreter_class(tree).interpret)
+        print(f'{name:<40}: {seconds * 1000:8.1f} ms')
+
+
+BENCHMARKS = {
+    'analyze': bench_analyze,
+    'ast': bench_ast,
+    'calls': bench_calls,
+    'edit': bench_edit,
+    'interpret': bench_interpret,
+    'parse': bench_parse,
+    'tokens': bench_tokens,
+}
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description='Run SPI benchmarks on a generated Pascal program.'
+    )
+    argparser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    argparser.add_argument(
+        '--procedures',
+        help='Number of procedures in the generated program',
+        type=int,
+        default=200,
+    )
+    args = argparser.parse_args()
+
+    text = generate_program(procedures=args.procedures)
+    BENCHMARKS[args.benchmark](text)
+
+
+if __name__ == '__main__':
+    main()
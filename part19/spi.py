@@ -1,7 +1,19 @@
 """SPI - Simple Pascal Interpreter. Part 19"""
 
 import argparse
+import bisect
+import collections
+import concurrent.futures
+import contextlib
+import gc
+import hashlib
+import mmap
+import operator
+import os
+import pickle
+import re
 import sys
+from array import array
 from enum import Enum
 
 _SHOULD_LOG_SCOPE = False  # see '--scope' command line option
@@ -9,9 +21,13 @@ _SHOULD_LOG_STACK = False  # see '--stack' command line option
 
 
 class ErrorCode(Enum):
-    UNEXPECTED_TOKEN = 'Unexpected token'
-    ID_NOT_FOUND     = 'Identifier not found'
-    DUPLICATE_ID     = 'Duplicate id found'
+    UNEXPECTED_TOKEN     = 'Unexpected token'
+    ID_NOT_FOUND         = 'Identifier not found'
+    DUPLICATE_ID         = 'Duplicate id found'
+    TYPE_MISMATCH        = 'Type mismatch'
+    NOT_A_VARIABLE       = 'Identifier is not a variable'
+    NOT_A_PROCEDURE      = 'Identifier is not a procedure'
+    UNTERMINATED_COMMENT = 'Unterminated comment'
 
 
 class Error(Exception):
@@ -71,30 +87,156 @@ class TokenType(Enum):
 
 
 class Token:
-    def __init__(self, type, value, lineno=None, column=None):
+    __slots__ = ('type', 'value', 'pos', 'lines')
+
+    def __init__(self, type, value, pos=None, lines=None):
         self.type = type
         self.value = value
-        self.lineno = lineno
-        self.column = column
+        # offset of the lexeme in the source text and the LineIndex that
+        # turns it into a line and a column number when they are needed
+        self.pos = pos
+        self.lines = lines
+
+    def position(self):
+        """Return the (lineno, column) pair of the token."""
+        if self.lines is None:
+            return None, None
+        return self.lines.position(self.pos)
+
+    @property
+    def lineno(self):
+        return self.position()[0]
+
+    @property
+    def column(self):
+        return self.position()[1]
 
     def __str__(self):
         """String representation of the class instance.
 
         Example:
-            >>> Token(TokenType.INTEGER, 7, lineno=5, column=10)
-            Token(TokenType.INTEGER, 7, position=5:10)
+            >>> Token(TokenType.INTEGER_CONST, 7, 8, LineIndex('x :=\\n   7'))
+            Token(TokenType.INTEGER_CONST, 7, position=2:4)
         """
+        lineno, column = self.position()
         return 'Token({type}, {value}, position={lineno}:{column})'.format(
             type=self.type,
             value=repr(self.value),
-            lineno=self.lineno,
-            column=self.column,
+            lineno=lineno,
+            column=column,
         )
 
     def __repr__(self):
         return self.__str__()
 
 
+class IdToken(Token):
+    """Token of an identifier.
+
+    Its value is the shared copy of the name kept in a NameTable and
+    `name_id` is the id of the name in that table.
+    """
+    __slots__ = ('name_id',)
+
+    def __init__(self, value, name_id, pos=None, lines=None):
+        self.type = TokenType.ID
+        self.value = value
+        self.name_id = name_id
+        self.pos = pos
+        self.lines = lines
+
+
+class LineIndex:
+    """Turns offsets into a source text into line and column numbers.
+
+    Tokens carry only the offset of their lexeme. Line and column
+    numbers are needed only to report errors, so the offsets of line
+    starts are found (with one pass over the text) on the first lookup
+    and then searched with bisect.
+    """
+    def __init__(self, text=None):
+        self.text = text
+        if text is None:
+            # line starts are added by the lexer, see add_line_start
+            self._line_starts = array('Q', [0])
+        else:
+            self._line_starts = None
+        # (lines, offset, delta) once the text has been edited, see forward
+        self._forward = None
+
+    def add_line_start(self, offset):
+        self._line_starts.append(offset)
+
+    def forward(self, lines, offset, delta):
+        """Resolve offsets through `lines`, the index of an edited text.
+
+        The edit ended at `offset` in this text and moved everything
+        after it by `delta` characters. Tokens that survive the edit keep
+        their offsets and this index; see IncrementalParser.
+        """
+        self.text = self._line_starts = None
+        self._forward = (lines, offset, delta)
+
+    def resolve(self, offset):
+        """Return the index of the current text, at the end of the chain
+        of forwarded indexes, and the offset in it that the offset in
+        this text moved to."""
+        lines = self
+        while lines._forward is not None:
+            lines, edit_end, delta = lines._forward
+            if offset >= edit_end:
+                offset += delta
+        return lines, offset
+
+    def resolve_many(self, offsets):
+        """Return the index of the current text and the list of offsets
+        in it that the sorted `offsets` in this text moved to.
+
+        The offsets have to be outside of the edited ranges (those of
+        the tokens that survived the edits), so they keep their order
+        and every edit moves a suffix of them: the start of the suffix
+        is found by bisection and all offsets are moved in one pass.
+        """
+        # (index of the first offset that it moves, delta) per edit
+        moves = []
+        lines = self
+        while lines._forward is not None:
+            lines, edit_end, delta = lines._forward
+            low, high = 0, len(offsets)
+            while low < high:
+                middle = (low + high) // 2
+                offset = offsets[middle] + sum(
+                    moved for start, moved in moves if start <= middle
+                )
+                if offset >= edit_end:
+                    high = middle
+                else:
+                    low = middle + 1
+            moves.append((low, delta))
+
+        shifts = [0] * (len(offsets) + 1)
+        for start, delta in moves:
+            shifts[start] += delta
+        shift = 0
+        resolved = []
+        for offset, delta in zip(offsets, shifts):
+            shift += delta
+            resolved.append(offset + shift)
+        return lines, resolved
+
+    def position(self, offset):
+        """Return the (lineno, column) pair of the offset."""
+        lines, offset = self.resolve(offset)
+        if lines._line_starts is None:
+            newline = '\n' if isinstance(lines.text, str) else b'\n'
+            lines._line_starts = array('Q', [0])
+            lines._line_starts.extend(
+                match.end() for match in re.finditer(newline, lines.text)
+            )
+        line_index = bisect.bisect_right(lines._line_starts, offset) - 1
+        return line_index + 1, offset - lines._line_starts[line_index] + 1
+
+
 def _build_reserved_keywords():
     """Build a dictionary of reserved keywords.
 
@@ -127,37 +269,131 @@ def _build_reserved_keywords():
 RESERVED_KEYWORDS = _build_reserved_keywords()
 
 
+def _build_operators():
+    """Build a dictionary of single-character tokens and the ':=' token.
+
+    Result:
+        {'+': <TokenType.PLUS: '+'>,
+         ...
+         ',': <TokenType.COMMA: ','>,
+         ':=': <TokenType.ASSIGN: ':='>}
+    """
+    tt_list = list(TokenType)
+    end_index = tt_list.index(TokenType.PROGRAM)
+    operators = {
+        token_type.value: token_type
+        for token_type in tt_list[:end_index]
+    }
+    operators[TokenType.ASSIGN.value] = TokenType.ASSIGN
+    return operators
+
+
+OPERATORS = _build_operators()
+
+
+def _build_flyweight_tokens():
+    """Build shared tokens for the token types with a fixed lexeme.
+
+    The tokens carry no position. They are handed out by token sources
+    that keep positions elsewhere, see TokenBufferReader.
+    """
+    return {
+        token_type: Token(token_type, token_type.value)
+        for token_type in (*OPERATORS.values(), *RESERVED_KEYWORDS.values())
+    }
+
+
+FLYWEIGHT_TOKENS = _build_flyweight_tokens()
+
+
+class NameTable:
+    """Identifier names of one compilation.
+
+    Every distinct name is stored once and gets a small integer id, its
+    index in self.names, that later phases can use as a key. The table
+    is shared by all lexers working on the same program.
+    """
+    def __init__(self):
+        self.names = []
+        # lexeme -> (token type, token value, name id) of every word
+        # (identifier or reserved keyword) lexeme seen so far
+        self._words = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def lookup(self, lexeme):
+        """Return the (token type, value, name id) triple of a word lexeme.
+
+        Only the first occurrence of a lexeme is upper-cased to check for
+        a reserved keyword (and decoded, for a bytes lexeme). The value of
+        an identifier is the shared copy of its name; keywords have no
+        name id.
+        """
+        entry = self._words.get(lexeme)
+        if entry is None:
+            name = lexeme if isinstance(lexeme, str) else lexeme.decode('ascii')
+            entry = self._words.get(name)
+            if entry is None:
+                token_type = RESERVED_KEYWORDS.get(name.upper())
+                if token_type is None:
+                    entry = (TokenType.ID, name, len(self.names))
+                    self.names.append(name)
+                else:
+                    entry = (token_type, token_type.value, None)
+                self._words[name] = entry
+            self._words[lexeme] = entry
+        return entry
+
+
+# the rest of an identifier after its first letter
+_ID_TAIL_REGEX = re.compile(r'[^\W_]*')
+_WHITESPACE_REGEX = re.compile(r'\s*')
+
+
+def _unterminated_comment_error(lines, offset):
+    """Return the LexerError for a comment opened at `offset`."""
+    lineno, column = lines.position(offset)
+    error_code = ErrorCode.UNTERMINATED_COMMENT
+    return LexerError(
+        error_code=error_code,
+        message=f'{error_code.value} line: {lineno} column: {column}',
+    )
+
+
 class Lexer:
-    def __init__(self, text):
+    def __init__(self, text, names=None):
         # client string input, e.g. "4 + 2 * 3 - 6 / 2"
         self.text = text
+        # identifier names of the program, see NameTable
+        self.names = NameTable() if names is None else names
         # self.pos is an index into self.text
         self.pos = 0
         self.current_char = self.text[self.pos]
-        # token line number and column number
-        self.lineno = 1
-        self.column = 1
+        # resolves token positions into line and column numbers
+        self.lines = LineIndex(text)
 
     def error(self):
+        lineno, column = self.lines.position(self.pos)
         s = "Lexer error on '{lexeme}' line: {lineno} column: {column}".format(
             lexeme=self.current_char,
-            lineno=self.lineno,
-            column=self.column,
+            lineno=lineno,
+            column=column,
         )
         raise LexerError(message=s)
 
     def advance(self):
         """Advance the `pos` pointer and set the `current_char` variable."""
-        if self.current_char == '\n':
-            self.lineno += 1
-            self.column = 0
-
         self.pos += 1
         if self.pos > len(self.text) - 1:
             self.current_char = None  # Indicates end of input
         else:
             self.current_char = self.text[self.pos]
-            self.column += 1
+
+    def jump(self, pos):
+        """Move the `pos` pointer to `pos` and set `current_char`."""
+        self.pos = pos - 1
+        self.advance()
 
     def peek(self):
         peek_pos = self.pos + 1
@@ -167,19 +403,20 @@ class Lexer:
             return self.text[peek_pos]
 
     def skip_whitespace(self):
-        while self.current_char is not None and self.current_char.isspace():
-            self.advance()
+        self.jump(_WHITESPACE_REGEX.match(self.text, self.pos).end())
 
     def skip_comment(self):
-        while self.current_char != '}':
-            self.advance()
-        self.advance()  # the closing curly brace
+        # self.pos is right after the opening curly brace
+        end = self.text.find('}', self.pos)
+        if end == -1:
+            raise _unterminated_comment_error(self.lines, self.pos - 1)
+        self.jump(end + 1)  # past the closing curly brace
 
     def number(self):
         """Return a (multidigit) integer or float consumed from the input."""
 
-        # Create a new token with current line and column number
-        token = Token(type=None, value=None, lineno=self.lineno, column=self.column)
+        # Create a new token with current position
+        token = Token(type=None, value=None, pos=self.pos, lines=self.lines)
 
         result = ''
         while self.current_char is not None and self.current_char.isdigit():
@@ -204,25 +441,15 @@ class Lexer:
 
     def _id(self):
         """Handle identifiers and reserved keywords"""
+        start = self.pos
+        end = _ID_TAIL_REGEX.match(self.text, start + 1).end()
+        self.jump(end)
 
-        # Create a new token with current line and column number
-        token = Token(type=None, value=None, lineno=self.lineno, column=self.column)
-
-        value = ''
-        while self.current_char is not None and self.current_char.isalnum():
-            value += self.current_char
-            self.advance()
-
-        token_type = RESERVED_KEYWORDS.get(value.upper())
-        if token_type is None:
-            token.type = TokenType.ID
-            token.value = value
-        else:
-            # reserved keyword
-            token.type = token_type
-            token.value = value.upper()
-
-        return token
+        token_type, value, name_id = self.names.lookup(self.text[start:end])
+        if token_type == TokenType.ID:
+            return IdToken(value, name_id, start, self.lines)
+        # reserved keyword
+        return Token(token_type, value, start, self.lines)
 
     def get_next_token(self):
         """Lexical analyzer (also known as scanner or tokenizer)
@@ -250,28 +477,24 @@ class Lexer:
                 token = Token(
                     type=TokenType.ASSIGN,
                     value=TokenType.ASSIGN.value,  # ':='
-                    lineno=self.lineno,
-                    column=self.column,
+                    pos=self.pos,
+                    lines=self.lines,
                 )
                 self.advance()
                 self.advance()
                 return token
 
-            # single-character token
-            try:
-                # get enum member by value, e.g.
-                # TokenType(';') --> TokenType.SEMI
-                token_type = TokenType(self.current_char)
-            except ValueError:
-                # no enum member with value equal to self.current_char
+            # single-character token, e.g. ';' --> TokenType.SEMI
+            token_type = OPERATORS.get(self.current_char)
+            if token_type is None:
                 self.error()
             else:
                 # create a token with a single-character lexeme as its value
                 token = Token(
                     type=token_type,
                     value=token_type.value,  # e.g. ';', '.', etc
-                    lineno=self.lineno,
-                    column=self.column,
+                    pos=self.pos,
+                    lines=self.lines,
                 )
                 self.advance()
                 return token
@@ -280,6 +503,486 @@ class Lexer:
         # input left for lexical analysis
         return Token(type=TokenType.EOF, value=None)
 
+    def tokenize(self):
+        """Lex the whole input up front into a TokenBuffer."""
+        buffer = TokenBuffer(self.text, self.names)
+        while True:
+            token = self.get_next_token()
+            if token.type == TokenType.EOF:
+                return buffer
+            buffer.append(token, self.pos - token.pos)
+
+
+# Master pattern of the RegexLexer. The alternatives are tried in order,
+# so ASSIGN has to come before the single-character COLON and the catch-all
+# ERROR group has to be the last one.
+_TOKEN_PATTERN = r"""
+    (?P<WHITESPACE>\s+)
+  | (?P<COMMENT>\{[^}]*\})
+  | (?P<ID>[^\W\d_][^\W_]*)
+  | (?P<REAL_CONST>\d+\.\d*)
+  | (?P<INTEGER_CONST>\d+)
+  | (?P<OPERATOR>:=|[-+*/();.:,])
+  | (?P<ERROR>.)
+"""
+_TOKEN_REGEX = re.compile(_TOKEN_PATTERN, re.VERBOSE | re.DOTALL)
+# the same pattern for bytes-like (ASCII) input, e.g. a memory-mapped file
+_TOKEN_REGEX_BYTES = re.compile(
+    _TOKEN_PATTERN.encode('ascii'), re.VERBOSE | re.DOTALL
+)
+
+
+class RegexLexer:
+    """Lexer driven by one compiled master regular expression.
+
+    Produces the same tokens (with the same positions) as Lexer, but
+    matches a whole lexeme at a time instead of walking the input
+    character by character.
+
+    The input is either a str or a bytes-like object holding an ASCII
+    source (bytes, memoryview, mmap). Lexemes of a bytes-like input
+    are decoded only when a token is created; identifiers only the
+    first time they are seen.
+
+    Only the part of the input between the offsets `start` and `end`
+    is lexed, the whole input by default.
+    """
+    def __init__(self, text, names=None, start=0, end=None):
+        self.text = text
+        # identifier names of the program, see NameTable
+        self.names = NameTable() if names is None else names
+        # self.pos is an index into self.text right after the last lexeme
+        self.pos = start
+        self.end = len(text) if end is None else end
+        # resolves token positions into line and column numbers
+        self.lines = LineIndex(text)
+        self._is_bytes = not isinstance(text, str)
+        if self._is_bytes:
+            self._regex, self._newline, self._brace = (
+                _TOKEN_REGEX_BYTES, b'\n', b'{'
+            )
+            self._operators = {
+                lexeme.encode('ascii'): token_type
+                for lexeme, token_type in OPERATORS.items()
+            }
+        else:
+            self._regex, self._newline, self._brace = _TOKEN_REGEX, '\n', '{'
+            self._operators = OPERATORS
+        self._tokens = self._generate_tokens()
+
+    def _decode(self, lexeme):
+        if self._is_bytes:
+            return lexeme.decode('ascii', 'backslashreplace')
+        return lexeme
+
+    def error(self, lexeme, offset):
+        if lexeme == self._brace:
+            # the master pattern matches only closed comments
+            raise _unterminated_comment_error(self.lines, offset)
+        lineno, column = self.lines.position(offset)
+        s = "Lexer error on '{lexeme}' line: {lineno} column: {column}".format(
+            lexeme=self._decode(lexeme),
+            lineno=lineno,
+            column=column,
+        )
+        raise LexerError(message=s)
+
+    def _make_token(self, kind, lexeme, start):
+        """Create a token out of the lexeme matched by the group `kind`.
+
+        Returns None for whitespace and comments. `start` is the offset
+        of the lexeme from the beginning of the input.
+        """
+        if kind == 'WHITESPACE' or kind == 'COMMENT':
+            return None
+
+        if kind == 'ERROR':
+            self.error(lexeme, start)
+
+        if kind == 'ID':
+            token_type, value, name_id = self.names.lookup(lexeme)
+            if token_type == TokenType.ID:
+                return IdToken(value, name_id, start, self.lines)
+            # reserved keyword
+            return Token(token_type, value, start, self.lines)
+        elif kind == 'REAL_CONST':
+            return Token(TokenType.REAL_CONST, float(lexeme), start, self.lines)
+        elif kind == 'INTEGER_CONST':
+            return Token(TokenType.INTEGER_CONST, int(lexeme), start, self.lines)
+        token_type = self._operators[lexeme]
+        return Token(token_type, token_type.value, start, self.lines)
+
+    def _generate_tokens(self):
+        for match in self._regex.finditer(self.text, self.pos, self.end):
+            self.pos = match.end()
+            token = self._make_token(
+                match.lastgroup, match.group(), match.start()
+            )
+            if token is not None:
+                yield token
+
+        while True:
+            yield Token(type=TokenType.EOF, value=None)
+
+    def get_next_token(self):
+        """Return the next token from the input, EOF once it is exhausted."""
+        return next(self._tokens)
+
+    def tokenize(self):
+        """Lex the whole input up front into a TokenBuffer."""
+        buffer = TokenBuffer(self.text, self.names)
+        types = buffer.types
+        starts = buffer.starts
+        lengths = buffer.lengths
+        values = buffer.values
+        literals = buffer.literals
+        codes = _TOKEN_TYPE_CODES
+        real_code = codes[TokenType.REAL_CONST]
+        integer_code = codes[TokenType.INTEGER_CONST]
+        lookup = self.names.lookup
+        operators = self._operators
+
+        for match in self._regex.finditer(self.text, self.pos, self.end):
+            kind = match.lastgroup
+            if kind == 'WHITESPACE' or kind == 'COMMENT':
+                continue
+
+            lexeme = match.group()
+            if kind == 'ID':
+                token_type, _, name_id = lookup(lexeme)
+                code = codes[token_type]
+                values.append(0 if name_id is None else name_id)
+            elif kind == 'REAL_CONST':
+                code = real_code
+                values.append(len(literals))
+                literals.append(float(lexeme))
+            elif kind == 'INTEGER_CONST':
+                code = integer_code
+                values.append(len(literals))
+                literals.append(int(lexeme))
+            elif kind == 'OPERATOR':
+                code = codes[operators[lexeme]]
+                values.append(0)
+            else:
+                self.error(lexeme, match.start())
+
+            types.append(code)
+            starts.append(match.start())
+            lengths.append(len(lexeme))
+
+        return buffer
+
+
+class StreamLexer(RegexLexer):
+    """RegexLexer that pulls the input from a file-like object.
+
+    The input is read in chunks of `chunk_size` characters (or bytes
+    for a binary stream) and tokens are produced lazily, so apart from
+    one offset per line kept to report positions, memory use does not
+    depend on the size of the input. A lexeme that touches the
+    end of the current chunk (an identifier, a number, ':' that may be
+    a part of ':=', an unclosed comment) is matched again once the next
+    chunk has been read.
+    """
+    def __init__(self, stream, chunk_size=65536):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        super().__init__(stream.read(chunk_size))
+        # the text is not kept, so line starts are recorded while lexing
+        self.lines = LineIndex()
+        # offset of self.text[0] from the beginning of the input
+        self._offset = 0
+        self._eof = False
+
+    def _fill(self, pos):
+        """Drop the text before `pos` and append the next chunk to the rest.
+
+        Returns False if the stream is exhausted.
+        """
+        if self._eof:
+            return False
+        # read at least as much as is left over, so that lexemes
+        # spanning many chunks (long comments) are re-matched
+        # a logarithmic number of times
+        chunk = self.stream.read(max(self.chunk_size, len(self.text) - pos))
+        if not chunk:
+            self._eof = True
+            return False
+        self._offset += pos
+        self.text = self.text[pos:] + chunk
+        self.pos = 0
+        return True
+
+    def tokenize(self):
+        """Lex the rest of the stream into a TokenBuffer.
+
+        The buffer holds no source text: its tokens are linked to the
+        line starts recorded by the lexer.
+        """
+        buffer = TokenBuffer(None, self.names)
+        buffer.lines = self.lines
+        while True:
+            token = self.get_next_token()
+            if token.type == TokenType.EOF:
+                return buffer
+            buffer.append(token, self._offset + self.pos - token.pos)
+
+    def _make_token(self, kind, lexeme, start):
+        if kind == 'WHITESPACE' or kind == 'COMMENT':
+            newline = self._newline
+            index = lexeme.find(newline)
+            while index != -1:
+                self.lines.add_line_start(start + index + 1)
+                index = lexeme.find(newline, index + 1)
+            return None
+        return super()._make_token(kind, lexeme, start)
+
+    def _generate_tokens(self):
+        pos = 0
+        while True:
+            if pos == len(self.text):
+                if self._fill(pos):
+                    pos = 0
+                    continue
+                break
+
+            match = self._regex.match(self.text, pos)
+            kind = match.lastgroup
+            if (
+                (match.end() == len(self.text) or
+                 kind == 'ERROR' and match.group() == self._brace) and
+                self._fill(pos)
+            ):
+                # the lexeme may continue in the next chunk
+                pos = 0
+                continue
+
+            pos = self.pos = match.end()
+            token = self._make_token(
+                kind, match.group(), self._offset + match.start()
+            )
+            if token is not None:
+                yield token
+
+        while True:
+            yield Token(type=TokenType.EOF, value=None)
+
+
+# TokenType <-> one-byte type code mapping used by TokenBuffer
+_TOKEN_TYPES = tuple(TokenType)
+_TOKEN_TYPE_CODES = {
+    token_type: code for code, token_type in enumerate(_TOKEN_TYPES)
+}
+
+
+class TokenBuffer:
+    """All tokens of a source text stored as a struct of arrays.
+
+    Instead of one Token object per token the buffer keeps a type code,
+    a start offset, a lexeme length and a value index per token in
+    compact arrays. The value index of an identifier is its id in the
+    NameTable and that of a number is its index in the self.literals
+    side table; the values of all other tokens follow from their type.
+    Token objects are only created when a token is read.
+    """
+    def __init__(self, text, names):
+        self.text = text
+        self.names = names
+        self.types = array('B')    # _TOKEN_TYPE_CODES values
+        self.starts = array('I')   # offsets of lexemes in self.text
+        self.lengths = array('I')  # lengths of lexemes
+        self.values = array('I')   # name ids and indexes into self.literals
+        self.literals = []         # values of number literals
+        self.lines = LineIndex(text)
+
+    def __len__(self):
+        return len(self.types)
+
+    def append(self, token, length):
+        if token.type == TokenType.ID:
+            self.values.append(token.name_id)
+        elif token.type in (TokenType.INTEGER_CONST, TokenType.REAL_CONST):
+            self.values.append(len(self.literals))
+            self.literals.append(token.value)
+        else:
+            self.values.append(0)
+        self.types.append(_TOKEN_TYPE_CODES[token.type])
+        self.starts.append(token.pos)
+        self.lengths.append(length)
+
+    def slice(self, start, stop):
+        """Return a new buffer with the tokens start..stop-1."""
+        buffer = TokenBuffer(self.text, self.names)
+        buffer.lines = self.lines
+        buffer.literals = self.literals
+        buffer.types = self.types[start:stop]
+        buffer.starts = self.starts[start:stop]
+        buffer.lengths = self.lengths[start:stop]
+        buffer.values = self.values[start:stop]
+        return buffer
+
+    def token(self, index, flyweight=False):
+        """Materialize the token with the given index as a Token object.
+
+        With `flyweight` set, the shared positionless token from
+        FLYWEIGHT_TOKENS is returned for operators and keywords.
+        """
+        token_type = _TOKEN_TYPES[self.types[index]]
+        if flyweight and token_type in FLYWEIGHT_TOKENS:
+            return FLYWEIGHT_TOKENS[token_type]
+        start = self.starts[index]
+        if token_type == TokenType.ID:
+            name_id = self.values[index]
+            return IdToken(self.names.names[name_id], name_id, start, self.lines)
+        elif token_type in (TokenType.INTEGER_CONST, TokenType.REAL_CONST):
+            value = self.literals[self.values[index]]
+        else:
+            value = token_type.value
+        return Token(token_type, value, start, self.lines)
+
+    def reader(self, index=0, flyweights=True):
+        return TokenBufferReader(self, index, flyweights)
+
+    def __getstate__(self):
+        # the text is only needed for lexing; the buffers of a cached
+        # tree (see LazyBlock) do not store the source
+        state = self.__dict__.copy()
+        state['text'] = None
+        return state
+
+
+class TokenBufferReader:
+    """Token source that reads a TokenBuffer by index.
+
+    It can be handed to Parser in place of a lexer. Positions are kept
+    in the buffer, so by default operators and keywords are returned as
+    shared flyweight tokens; `locate` recovers the position of such a
+    token when an error has to be reported.
+    """
+    def __init__(self, buffer, index=0, flyweights=True):
+        self.buffer = buffer
+        # index of the next token to return
+        self.index = index
+        self.flyweights = flyweights
+
+    def get_next_token(self):
+        index = self.index
+        if index >= len(self.buffer):
+            self.index = len(self.buffer) + 1
+            return Token(type=TokenType.EOF, value=None)
+        self.index = index + 1
+        return self.buffer.token(index, self.flyweights)
+
+    def locate(self, token, lookahead=0):
+        """Return the token that was returned `lookahead` tokens before
+        the last returned one, with its position."""
+        index = self.index - 1 - lookahead
+        if token.pos is not None or index >= len(self.buffer):
+            return token
+        return self.buffer.token(index)
+
+
+# a whitespace character or the start of a comment
+_SPLIT_REGEX = re.compile(r'[\s{]')
+_SPLIT_REGEX_BYTES = re.compile(rb'[\s{]')
+
+
+def _find_split_points(text, chunk_size):
+    """Return offsets at which the text can be lexed in separate pieces.
+
+    A split point is a whitespace character outside of comments found
+    at or after every multiple of `chunk_size`. Comments are skipped
+    with str.find, so the scan does not look at every character.
+    """
+    if isinstance(text, str):
+        split_regex, open_brace, close_brace = _SPLIT_REGEX, '{', '}'
+    else:
+        split_regex, open_brace, close_brace = _SPLIT_REGEX_BYTES, b'{', b'}'
+
+    points = []
+    pos = 0  # everything before pos is outside of an open comment
+    target = chunk_size
+    while target < len(text):
+        match = split_regex.search(text, max(pos, target))
+        if match is None:
+            break
+        # skip comments opened before the candidate split point
+        brace = text.find(open_brace, pos, match.start())
+        if brace == -1 and match.group() != open_brace:
+            points.append(match.start())
+            pos = match.start() + 1
+            target = pos + chunk_size
+            continue
+        if brace == -1:
+            brace = match.start()
+        end = text.find(close_brace, brace + 1)
+        if end == -1:
+            # an unterminated comment, the rest can't be split
+            break
+        pos = end + 1
+    return points
+
+
+def _tokenize_chunk(args):
+    """Worker of tokenize_parallel: lex text[start:end] of the input."""
+    chunk, offset = args
+    lexer = RegexLexer(chunk)
+    try:
+        buffer = lexer.tokenize()
+    except LexerError:
+        return None
+    starts = array('I', [start + offset for start in buffer.starts])
+    return (
+        buffer.types, starts, buffer.lengths, buffer.values,
+        buffer.literals, lexer.names.names,
+    )
+
+
+def tokenize_parallel(text, workers=None, chunk_size=1 << 20, names=None):
+    """Lex a large input into a TokenBuffer using worker processes.
+
+    The input is split at whitespace outside of comments into pieces of
+    about `chunk_size` characters that are lexed by RegexLexer in a
+    ProcessPoolExecutor. The pieces are stitched back together in order,
+    with offsets, name ids and literal indexes corrected, so the result
+    is the same as that of RegexLexer(text).tokenize().
+    """
+    lexer = RegexLexer(text, names)
+    points = _find_split_points(text, chunk_size)
+    if not points:
+        return lexer.tokenize()
+
+    bounds = [0, *points, len(text)]
+    chunks = [
+        (text[start:end], start) for start, end in zip(bounds, bounds[1:])
+    ]
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        results = list(executor.map(_tokenize_chunk, chunks))
+    if None in results:
+        # raise the LexerError with the right position
+        return lexer.tokenize()
+
+    buffer = TokenBuffer(text, lexer.names)
+    id_code = _TOKEN_TYPE_CODES[TokenType.ID]
+    literal_codes = (
+        _TOKEN_TYPE_CODES[TokenType.INTEGER_CONST],
+        _TOKEN_TYPE_CODES[TokenType.REAL_CONST],
+    )
+    for types, starts, lengths, values, literals, chunk_names in results:
+        name_ids = [lexer.names.lookup(name)[2] for name in chunk_names]
+        literal_base = len(buffer.literals)
+        for index, code in enumerate(types):
+            if code == id_code:
+                values[index] = name_ids[values[index]]
+            elif code in literal_codes:
+                values[index] += literal_base
+        buffer.types.extend(types)
+        buffer.starts.extend(starts)
+        buffer.lengths.extend(lengths)
+        buffer.values.extend(values)
+        buffer.literals.extend(literals)
+    return buffer
+
 
 ###############################################################################
 #                                                                             #
@@ -287,83 +990,122 @@ class Lexer:
 #                                                                             #
 ###############################################################################
 class AST:
-    pass
+    # Nodes keep their fields in __slots__: no per-node __dict__, which
+    # matters for the large trees of generated programs and for the
+    # trees of many programs held in one process.
+    __slots__ = ()
 
 
 class BinOp(AST):
+    __slots__ = ('left', 'op', 'right', 'eval_type')
+
     def __init__(self, left, op, right):
         self.left = left
-        self.token = self.op = op
+        self.op = op
         self.right = right
+        # 'INTEGER' or 'REAL', set by TypeChecker
+        self.eval_type = None
 
 
 class Num(AST):
+    __slots__ = ('token', 'value', 'eval_type')
+
     def __init__(self, token):
         self.token = token
         self.value = token.value
+        self.eval_type = None
 
 
 class UnaryOp(AST):
+    __slots__ = ('op', 'expr', 'eval_type')
+
     def __init__(self, op, expr):
-        self.token = self.op = op
+        self.op = op
         self.expr = expr
+        self.eval_type = None
 
 
 class Compound(AST):
     """Represents a 'BEGIN ... END' block"""
+    __slots__ = ('children',)
+
     def __init__(self):
         self.children = []
 
 
 class Assign(AST):
+    __slots__ = ('left', 'op', 'right')
+
     def __init__(self, left, op, right):
         self.left = left
-        self.token = self.op = op
+        self.op = op
         self.right = right
 
 
 class Var(AST):
     """The Var node is constructed out of ID token."""
+    __slots__ = ('token', 'value', 'address', 'eval_type')
+
     def __init__(self, token):
         self.token = token
         self.value = token.value
+        # the (depth, slot) pair of the variable, set by SemanticAnalyzer:
+        # the number of scopes between the variable's and the node's one
+        # and the index of the variable in its ActivationRecord
+        self.address = None
+        self.eval_type = None
 
 
 class NoOp(AST):
-    pass
+    __slots__ = ()
 
 
 class Program(AST):
+    __slots__ = ('name', 'block', 'variables')
+
     def __init__(self, name, block):
         self.name = name
         self.block = block
+        # the VarSymbols of the global variables by slot, set by
+        # SemanticAnalyzer
+        self.variables = None
 
 
 class Block(AST):
+    __slots__ = ('declarations', 'compound_statement')
+
     def __init__(self, declarations, compound_statement):
         self.declarations = declarations
         self.compound_statement = compound_statement
 
 
 class VarDecl(AST):
+    __slots__ = ('var_node', 'type_node')
+
     def __init__(self, var_node, type_node):
         self.var_node = var_node
         self.type_node = type_node
 
 
 class Type(AST):
+    __slots__ = ('token', 'value')
+
     def __init__(self, token):
         self.token = token
         self.value = token.value
 
 
 class Param(AST):
+    __slots__ = ('var_node', 'type_node')
+
     def __init__(self, var_node, type_node):
         self.var_node = var_node
         self.type_node = type_node
 
 
 class ProcedureDecl(AST):
+    __slots__ = ('proc_name', 'formal_params', 'block_node')
+
     def __init__(self, proc_name, formal_params, block_node):
         self.proc_name = proc_name
         self.formal_params = formal_params  # a list of Param nodes
@@ -371,6 +1113,8 @@ class ProcedureDecl(AST):
 
 
 class ProcedureCall(AST):
+    __slots__ = ('proc_name', 'actual_params', 'token', 'proc_symbol')
+
     def __init__(self, proc_name, actual_params, token):
         self.proc_name = proc_name
         self.actual_params = actual_params  # a list of AST nodes
@@ -379,21 +1123,129 @@ class ProcedureCall(AST):
         self.proc_symbol = None
 
 
+class LazyBlock(AST):
+    """The block of a procedure that is parsed only when it is needed.
+
+    Holds the range of the block's tokens in a TokenBuffer, see
+    LazyParser. The SemanticAnalyzer records the scope the block is
+    declared in and its own class; the Interpreter parses the block and
+    analyzes it with that class the first time the procedure is called.
+    """
+    __slots__ = ('buffer', 'start', 'stop', 'scope', 'analyzer', 'block')
+
+    def __init__(self, buffer, start, stop):
+        self.buffer = buffer
+        self.start = start  # index of the first token of the block
+        self.stop = stop    # index right after the last token
+        # the procedure scope and the analyzer class, set by
+        # SemanticAnalyzer
+        self.scope = None
+        self.analyzer = None
+        # the parsed and analyzed Block node
+        self.block = None
+
+    def parse(self):
+        """Parse the tokens of the block and return a Block node."""
+        parser = LazyParser(self.buffer.reader(self.start))
+        return parser.block()
+
+
+# Binary operators and their precedence: a higher number binds tighter.
+# All binary operators are left-associative. To add an operator to the
+# language, add its token type here (and evaluate it in the Interpreter).
+BINARY_OPERATORS = {
+    TokenType.PLUS:        1,
+    TokenType.MINUS:       1,
+    TokenType.MUL:         2,
+    TokenType.INTEGER_DIV: 2,
+    TokenType.FLOAT_DIV:   2,
+}
+
+# Prefix operators, they apply to the factor that follows them.
+UNARY_OPERATORS = frozenset((TokenType.PLUS, TokenType.MINUS))
+
+# Tokens at which the parser resumes after a syntax error,
+# see Parser.parse_with_recovery
+SYNC_TOKENS = frozenset((
+    TokenType.SEMI,
+    TokenType.END,
+    TokenType.PROCEDURE,
+    TokenType.EOF,
+))
+
+
 class Parser:
     def __init__(self, lexer):
+        # any token source: a lexer, a TokenBufferReader, ...
         self.lexer = lexer
+        # tokens that follow the current token and were already taken
+        # from the token source by peek()
+        self._lookahead = collections.deque()
+        # collect syntax errors instead of stopping at the first one
+        self.recovering = False
+        self.errors = []
         # set current token to the first token taken from the input
         self.current_token = self.get_next_token()
 
     def get_next_token(self):
+        if self._lookahead:
+            return self._lookahead.popleft()
         return self.lexer.get_next_token()
 
+    def current_index(self):
+        """Return the index of the current token in the TokenBuffer
+        that the parser reads with a TokenBufferReader."""
+        return self.lexer.index - 1 - len(self._lookahead)
+
+    def peek(self, k=1):
+        """Return the k-th token after the current token without
+        consuming it. Past the end of the input that is the EOF token.
+        """
+        lookahead = self._lookahead
+        while len(lookahead) < k:
+            last = lookahead[-1] if lookahead else self.current_token
+            if last.type == TokenType.EOF:
+                return last
+            lookahead.append(self.lexer.get_next_token())
+        return lookahead[k - 1]
+
     def error(self, error_code, token):
-        raise ParserError(
+        if token.pos is None and hasattr(self.lexer, 'locate'):
+            # a shared flyweight token, see TokenBufferReader
+            token = self.lexer.locate(token, len(self._lookahead))
+        error = ParserError(
             error_code=error_code,
             token=token,
             message=f'{error_code.value} -> {token}',
         )
+        if self.recovering:
+            self.record_error(error)
+        raise error
+
+    def record_error(self, error):
+        last = self.errors[-1].token if self.errors else None
+        if last is not None and (last.type, last.pos) == (
+            error.token.type, error.token.pos
+        ):
+            # the parser could not resume at the token of the previous
+            # error, this one is a consequence of it
+            return
+        self.errors.append(error)
+
+    def synchronize(self):
+        """Skip tokens up to the next one in SYNC_TOKENS."""
+        while self.current_token.type not in SYNC_TOKENS:
+            self.current_token = self.get_next_token()
+
+    def skip_unexpected_token(self):
+        """Record an error at the current token and synchronize."""
+        try:
+            self.error(
+                error_code=ErrorCode.UNEXPECTED_TOKEN,
+                token=self.current_token,
+            )
+        except ParserError:
+            self.synchronize()
 
     def eat(self, token_type):
         # compare the current token type with the passed token
@@ -430,18 +1282,41 @@ class Parser:
         """
         declarations : (VAR (variable_declaration SEMI)+)? procedure_declaration*
         """
+        declarations = self.variable_declarations()
+
+        while self.current_token.type == TokenType.PROCEDURE:
+            try:
+                proc_decl = self.procedure_declaration()
+                declarations.append(proc_decl)
+            except ParserError:
+                if not self.recovering:
+                    raise
+                self.synchronize()
+                if self.current_token.type == TokenType.SEMI:
+                    self.eat(TokenType.SEMI)
+
+        return declarations
+
+    def variable_declarations(self):
+        """The optional VAR part of declarations:
+
+        (VAR (variable_declaration SEMI)+)?
+        """
         declarations = []
 
         if self.current_token.type == TokenType.VAR:
             self.eat(TokenType.VAR)
             while self.current_token.type == TokenType.ID:
-                var_decl = self.variable_declaration()
-                declarations.extend(var_decl)
-                self.eat(TokenType.SEMI)
-
-        while self.current_token.type == TokenType.PROCEDURE:
-            proc_decl = self.procedure_declaration()
-            declarations.append(proc_decl)
+                try:
+                    var_decl = self.variable_declaration()
+                    declarations.extend(var_decl)
+                    self.eat(TokenType.SEMI)
+                except ParserError:
+                    if not self.recovering:
+                        raise
+                    self.synchronize()
+                    if self.current_token.type == TokenType.SEMI:
+                        self.eat(TokenType.SEMI)
 
         return declarations
 
@@ -504,6 +1379,30 @@ class Parser:
         """procedure_declaration :
              PROCEDURE ID (LPAREN formal_parameter_list RPAREN)? SEMI block SEMI
         """
+        try:
+            proc_name, formal_params = self.procedure_heading()
+        except ParserError:
+            if not self.recovering:
+                raise
+            # still parse the body, for its errors, but leave the
+            # declaration out of the tree
+            self.synchronize()
+            if self.current_token.type == TokenType.SEMI:
+                self.eat(TokenType.SEMI)
+                self.block()
+            raise
+        block_node = self.block()
+        proc_decl = ProcedureDecl(proc_name, formal_params, block_node)
+        self.eat(TokenType.SEMI)
+        return proc_decl
+
+    def procedure_heading(self):
+        """The part of procedure_declaration before the block:
+
+        PROCEDURE ID (LPAREN formal_parameter_list RPAREN)? SEMI
+
+        Returns the procedure name and its list of Param nodes.
+        """
         self.eat(TokenType.PROCEDURE)
         proc_name = self.current_token.value
         self.eat(TokenType.ID)
@@ -515,10 +1414,7 @@ class Parser:
             self.eat(TokenType.RPAREN)
 
         self.eat(TokenType.SEMI)
-        block_node = self.block()
-        proc_decl = ProcedureDecl(proc_name, formal_params, block_node)
-        self.eat(TokenType.SEMI)
-        return proc_decl
+        return proc_name, formal_params
 
     def type_spec(self):
         """type_spec : INTEGER
@@ -555,11 +1451,14 @@ class Parser:
 
         results = [node]
 
-        while self.current_token.type == TokenType.SEMI:
-            self.eat(TokenType.SEMI)
-            results.append(self.statement())
-
-        return results
+        while True:
+            while self.current_token.type == TokenType.SEMI:
+                self.eat(TokenType.SEMI)
+                results.append(self.statement())
+            if not self.recovering or self.current_token.type in SYNC_TOKENS:
+                return results
+            # a statement followed by something else than SEMI or END
+            self.skip_unexpected_token()
 
     def statement(self):
         """
@@ -568,15 +1467,22 @@ class Parser:
                   | assignment_statement
                   | empty
         """
-        if self.current_token.type == TokenType.BEGIN:
-            node = self.compound_statement()
-        elif (self.current_token.type == TokenType.ID and
-              self.lexer.current_char == '('
-        ):
-            node = self.proccall_statement()
-        elif self.current_token.type == TokenType.ID:
-            node = self.assignment_statement()
-        else:
+        try:
+            if self.current_token.type == TokenType.BEGIN:
+                node = self.compound_statement()
+            elif (self.current_token.type == TokenType.ID and
+                  self.peek().type == TokenType.LPAREN
+            ):
+                node = self.proccall_statement()
+            elif self.current_token.type == TokenType.ID:
+                node = self.assignment_statement()
+            else:
+                node = self.empty()
+        except ParserError:
+            if not self.recovering:
+                raise
+            # leave the statement out of the tree
+            self.synchronize()
             node = self.empty()
         return node
 
@@ -629,69 +1535,43 @@ class Parser:
         """An empty production"""
         return NoOp()
 
-    def expr(self):
-        """
-        expr : term ((PLUS | MINUS) term)*
+    def expr(self, min_precedence=1):
         """
-        node = self.term()
-
-        while self.current_token.type in (TokenType.PLUS, TokenType.MINUS):
-            token = self.current_token
-            if token.type == TokenType.PLUS:
-                self.eat(TokenType.PLUS)
-            elif token.type == TokenType.MINUS:
-                self.eat(TokenType.MINUS)
+        expr : factor (binary_operator factor)*
 
-            node = BinOp(left=node, op=token, right=self.term())
-
-        return node
-
-    def term(self):
-        """term : factor ((MUL | INTEGER_DIV | FLOAT_DIV) factor)*"""
+        Precedence climbing: operators bind according to BINARY_OPERATORS,
+        all of them left-associative. The loop only consumes operators
+        that bind at least as tightly as `min_precedence`, and parses
+        the right operand with a higher minimum, so `a - b + c` groups
+        as `(a - b) + c` and `a + b * c` as `a + (b * c)`.
+        """
         node = self.factor()
 
-        while self.current_token.type in (
-                TokenType.MUL,
-                TokenType.INTEGER_DIV,
-                TokenType.FLOAT_DIV,
-        ):
+        while True:
             token = self.current_token
-            if token.type == TokenType.MUL:
-                self.eat(TokenType.MUL)
-            elif token.type == TokenType.INTEGER_DIV:
-                self.eat(TokenType.INTEGER_DIV)
-            elif token.type == TokenType.FLOAT_DIV:
-                self.eat(TokenType.FLOAT_DIV)
-
-            node = BinOp(left=node, op=token, right=self.factor())
-
-        return node
+            precedence = BINARY_OPERATORS.get(token.type)
+            if precedence is None or precedence < min_precedence:
+                return node
+            self.current_token = self.get_next_token()
+            node = BinOp(left=node, op=token, right=self.expr(precedence + 1))
 
     def factor(self):
-        """factor : PLUS factor
-                  | MINUS factor
+        """factor : unary_operator factor
                   | INTEGER_CONST
                   | REAL_CONST
                   | LPAREN expr RPAREN
                   | variable
         """
         token = self.current_token
-        if token.type == TokenType.PLUS:
-            self.eat(TokenType.PLUS)
-            node = UnaryOp(token, self.factor())
-            return node
-        elif token.type == TokenType.MINUS:
-            self.eat(TokenType.MINUS)
-            node = UnaryOp(token, self.factor())
-            return node
-        elif token.type == TokenType.INTEGER_CONST:
-            self.eat(TokenType.INTEGER_CONST)
-            return Num(token)
-        elif token.type == TokenType.REAL_CONST:
-            self.eat(TokenType.REAL_CONST)
+        token_type = token.type
+        if token_type in UNARY_OPERATORS:
+            self.current_token = self.get_next_token()
+            return UnaryOp(token, self.factor())
+        elif token_type in (TokenType.INTEGER_CONST, TokenType.REAL_CONST):
+            self.current_token = self.get_next_token()
             return Num(token)
-        elif token.type == TokenType.LPAREN:
-            self.eat(TokenType.LPAREN)
+        elif token_type == TokenType.LPAREN:
+            self.current_token = self.get_next_token()
             node = self.expr()
             self.eat(TokenType.RPAREN)
             return node
@@ -735,17 +1615,19 @@ class Parser:
 
         empty :
 
-        expr : term ((PLUS | MINUS) term)*
+        expr : factor (binary_operator factor)*
 
-        term : factor ((MUL | INTEGER_DIV | FLOAT_DIV) factor)*
+        binary_operator : PLUS | MINUS                    (precedence 1)
+                        | MUL | INTEGER_DIV | FLOAT_DIV   (precedence 2)
 
-        factor : PLUS factor
-               | MINUS factor
+        factor : unary_operator factor
                | INTEGER_CONST
                | REAL_CONST
                | LPAREN expr RPAREN
                | variable
 
+        unary_operator : PLUS | MINUS
+
         variable: ID
         """
         node = self.program()
@@ -757,39 +1639,972 @@ class Parser:
 
         return node
 
+    def parse_with_recovery(self):
+        """Parse the program and collect all syntax errors.
 
-###############################################################################
-#                                                                             #
-#  AST visitors (walkers)                                                     #
-#                                                                             #
-###############################################################################
+        After an error the parser skips to the next token in SYNC_TOKENS
+        and resumes with the next statement or declaration. Returns the
+        tree, in which the statements and declarations with errors are
+        left out, and the list of ParserError exceptions in source order.
+        The tree is None if the parser could not resume before the end
+        of the program. Lexer errors are not recovered from.
+        """
+        self.recovering = True
+        tree = None
+        try:
+            tree = self.program()
+            if self.current_token.type != TokenType.EOF:
+                self.error(
+                    error_code=ErrorCode.UNEXPECTED_TOKEN,
+                    token=self.current_token,
+                )
+        except ParserError:
+            pass
+        return tree, self.errors
 
-class NodeVisitor:
-    def visit(self, node):
-        method_name = 'visit_' + type(node).__name__
-        visitor = getattr(self, method_name, self.generic_visit)
-        return visitor(node)
 
-    def generic_visit(self, node):
-        raise Exception('No visit_{} method'.format(type(node).__name__))
+class LazyParser(Parser):
+    """A Parser that leaves the blocks of procedures unparsed.
 
+    Procedure declarations get a LazyBlock that records the range of
+    the block's tokens. Finding the range only needs the token types:
+    each block ends with the END that closes its compound statement and
+    every nested PROCEDURE opens one more block. Syntax errors in a
+    block are reported when the block is parsed.
 
-###############################################################################
-#                                                                             #
-#  SYMBOLS, TABLES, SEMANTIC ANALYSIS                                         #
-#                                                                             #
-###############################################################################
+    The tokens are read from a TokenBuffer. A lexer that is passed in
+    is run over the whole input first.
+    """
+    def __init__(self, lexer):
+        if not isinstance(lexer, TokenBufferReader):
+            lexer = lexer.tokenize().reader()
+        super().__init__(lexer)
 
-class Symbol:
-    def __init__(self, name, type=None):
-        self.name = name
-        self.type = type
-        self.scope_level = 0
+    def procedure_declaration(self):
+        """procedure_declaration :
+             PROCEDURE ID (LPAREN formal_parameter_list RPAREN)? SEMI block SEMI
+        """
+        try:
+            proc_name, formal_params = self.procedure_heading()
+        except ParserError:
+            if not self.recovering:
+                raise
+            # skip the body like Parser.procedure_declaration parses it
+            self.synchronize()
+            if self.current_token.type == TokenType.SEMI:
+                self.eat(TokenType.SEMI)
+                self.skip_block()
+            raise
+        block_node = self.skip_block()
+        proc_decl = ProcedureDecl(proc_name, formal_params, block_node)
+        self.eat(TokenType.SEMI)
+        return proc_decl
+
+    def skip_block(self):
+        """Skip the tokens of the block that starts with the current
+        token and return a LazyBlock for them."""
+        reader = self.lexer
+        types = reader.buffer.types
+        begin = _TOKEN_TYPE_CODES[TokenType.BEGIN]
+        end = _TOKEN_TYPE_CODES[TokenType.END]
+        procedure = _TOKEN_TYPE_CODES[TokenType.PROCEDURE]
+
+        start = index = self.current_index()
+        blocks = 1  # blocks that are not closed yet
+        depth = 0   # nesting of compound statements
+        while index < len(types):
+            code = types[index]
+            index += 1
+            if code == begin:
+                depth += 1
+            elif code == end:
+                depth -= 1
+                if depth == 0:
+                    blocks -= 1
+                    if blocks == 0:
+                        break
+            elif code == procedure:
+                blocks += 1
+
+        self._lookahead.clear()
+        reader.index = index
+        self.current_token = self.get_next_token()
+        if blocks:
+            # the end of the input
+            self.error(
+                error_code=ErrorCode.UNEXPECTED_TOKEN,
+                token=self.current_token,
+            )
+        return LazyBlock(reader.buffer, start, index)
+
+
+# Markers kept on the IterativeParser operator stack next to the
+# binary operator precedences, which are all >= 1
+_GROUP_MARK = 0    # an open LPAREN
+_UNARY_MARK = -1   # a unary operator waiting for its factor
+
+
+class IterativeParser(Parser):
+    """A Parser that keeps nested constructs on explicit stacks.
+
+    Parenthesized expressions, unary operators, compound statements and
+    procedure declarations can be nested to any depth without hitting
+    Python's recursion limit. The grammar, the AST and the errors are
+    the same as those of Parser: tokens are consumed in the same order
+    and every error is raised at the same token.
+    """
+    def block(self):
+        """
+        block : declarations compound_statement
+
+        The declarations, names and parameters of the procedures that
+        enclose the current block are kept on a stack.
+        """
+        procedures = []
+        declarations = self.variable_declarations()
+
+        while True:
+            if self.current_token.type == TokenType.PROCEDURE:
+                try:
+                    proc_name, formal_params = self.procedure_heading()
+                except ParserError:
+                    if not self.recovering:
+                        raise
+                    self.synchronize()
+                    if self.current_token.type != TokenType.SEMI:
+                        continue
+                    self.eat(TokenType.SEMI)
+                    # still parse the body, for its errors, but leave
+                    # the declaration out of the tree
+                    proc_name = formal_params = None
+                procedures.append((proc_name, formal_params, declarations))
+                try:
+                    declarations = self.variable_declarations()
+                except ParserError:
+                    if not self.recovering:
+                        raise
+                    declarations = self.skip_procedure(procedures)
+                continue
+
+            if not procedures:
+                return Block(declarations, self.compound_statement())
+
+            try:
+                node = Block(declarations, self.compound_statement())
+                proc_name, formal_params, declarations = procedures[-1]
+                if proc_name is None:
+                    declarations = self.skip_procedure(procedures)
+                    continue
+                self.eat(TokenType.SEMI)
+            except ParserError:
+                if not self.recovering:
+                    raise
+                declarations = self.skip_procedure(procedures)
+                continue
+            procedures.pop()
+            proc_decl = ProcedureDecl(proc_name, formal_params, node)
+            declarations.append(proc_decl)
+
+    def skip_procedure(self, procedures):
+        """Leave the innermost procedure on the stack out of the tree
+        after an error in it and return the declarations of its
+        enclosing block, resuming like Parser.declarations."""
+        self.synchronize()
+        if self.current_token.type == TokenType.SEMI:
+            self.eat(TokenType.SEMI)
+        return procedures.pop()[2]
+
+    def compound_statement(self):
+        """
+        compound_statement: BEGIN statement_list END
+
+        The statements of the enclosing compound statements are kept
+        on a stack.
+        """
+        self.eat(TokenType.BEGIN)
+        statements = [[]]
+
+        while True:
+            if self.current_token.type == TokenType.BEGIN:
+                self.eat(TokenType.BEGIN)
+                statements.append([])
+                continue
+
+            statements[-1].append(self.statement())
+
+            # close the compound statements that end here
+            while self.current_token.type != TokenType.SEMI:
+                if (self.recovering and
+                        self.current_token.type not in SYNC_TOKENS):
+                    self.skip_unexpected_token()
+                    continue
+                self.eat(TokenType.END)
+                root = Compound()
+                root.children = statements.pop()
+                if not statements:
+                    return root
+                statements[-1].append(root)
+
+            self.eat(TokenType.SEMI)
+
+    def expr(self):
+        """
+        expr : factor (binary_operator factor)*
+
+        Shunting-yard version of Parser.expr: operands wait on one stack
+        and operators, unary operators and open parentheses on another.
+        """
+        operands = []
+        operators = []  # (precedence or marker, token) pairs
+
+        while True:
+            # factor: unary operators and open parentheses, then an operand
+            token = self.current_token
+            while True:
+                if token.type in UNARY_OPERATORS:
+                    operators.append((_UNARY_MARK, token))
+                elif token.type == TokenType.LPAREN:
+                    operators.append((_GROUP_MARK, token))
+                else:
+                    break
+                token = self.current_token = self.get_next_token()
+
+            if token.type in (TokenType.INTEGER_CONST, TokenType.REAL_CONST):
+                self.current_token = self.get_next_token()
+                operands.append(Num(token))
+            else:
+                operands.append(self.variable())
+
+            while True:
+                # the factor is complete: apply its unary operators
+                while operators and operators[-1][0] == _UNARY_MARK:
+                    op = operators.pop()[1]
+                    operands.append(UnaryOp(op, operands.pop()))
+
+                token = self.current_token
+                precedence = BINARY_OPERATORS.get(token.type)
+                if precedence is not None:
+                    break
+
+                # the end of the expression or of a parenthesized group
+                self._reduce(operands, operators, 1)
+                if not operators:
+                    return operands.pop()
+                self.eat(TokenType.RPAREN)
+                operators.pop()
+
+            self._reduce(operands, operators, precedence)
+            operators.append((precedence, token))
+            self.current_token = self.get_next_token()
+
+    @staticmethod
+    def _reduce(operands, operators, min_precedence):
+        """Build BinOp nodes for the stacked binary operators that bind
+        at least as tightly as `min_precedence`."""
+        while operators and operators[-1][0] >= min_precedence:
+            op = operators.pop()[1]
+            right = operands.pop()
+            operands.append(BinOp(left=operands.pop(), op=op, right=right))
+
+
+class HashConsingParser(Parser):
+    """A Parser that shares structurally identical expressions.
+
+    Expressions have no side effects, so within a block every BinOp and
+    UnaryOp subtree of an expression is replaced by the first identical
+    one parsed in the block, and the tree becomes a DAG. A shared node
+    stands for all its occurrences: later phases can use the node
+    itself as the key of a subexpression, and errors found in it are
+    reported once, at the first occurrence in the block. Num and Var
+    leaves are not shared, their tokens have the positions of their own
+    occurrences.
+
+    The table of shared nodes is scoped to the block being parsed: the
+    names in an expression can mean different variables in different
+    blocks.
+    """
+    def __init__(self, lexer):
+        # key -> shared node, for the expressions of the current block
+        self.shared = {}
+        super().__init__(lexer)
+
+    def block(self):
+        enclosing = self.shared
+        self.shared = {}
+        try:
+            return super().block()
+        finally:
+            self.shared = enclosing
+
+    def expr(self, min_precedence=1):
+        return self.share(super().expr(min_precedence))
+
+    def share(self, node):
+        """Return the shared node that is identical to the expression
+        `node`, sharing its subtrees first.
+
+        Keys hold the shared children themselves, compared by identity,
+        so a subtree that is shared already is found without walking it
+        again: the right operands and parenthesized groups of an
+        expression were shared by the nested expr() calls.
+        """
+        if isinstance(node, BinOp):
+            key = (BinOp, node.op.type, _share_key(node.left),
+                   _share_key(node.right))
+            if self.shared.get(key) is node:
+                return node
+            node.left = self.share(node.left)
+            node.right = self.share(node.right)
+            key = (BinOp, node.op.type, _share_key(node.left),
+                   _share_key(node.right))
+        elif isinstance(node, UnaryOp):
+            key = (UnaryOp, node.op.type, _share_key(node.expr))
+            if self.shared.get(key) is node:
+                return node
+            node.expr = self.share(node.expr)
+            key = (UnaryOp, node.op.type, _share_key(node.expr))
+        else:
+            # a Num or Var leaf
+            return node
+        return self.shared.setdefault(key, node)
+
+
+def _share_key(node):
+    """Return what stands for the child `node` in the key of a shared
+    node: the value of a leaf, the shared node itself otherwise."""
+    if isinstance(node, Num):
+        # 2 and 2.0 are equal, but not the same literal
+        return (Num, node.token.type, node.value)
+    if isinstance(node, Var):
+        return (Var, node.value)
+    return node
+
+
+class _Span:
+    """The range of text that a ProcedureDecl or Compound node was
+    parsed from, up to the start of the next token, and the spans of
+    the nodes nested in it."""
+    __slots__ = ('node', 'start', 'end', 'children')
+
+    def __init__(self, node, start, end, children):
+        self.node = node
+        self.start = start
+        self.end = end
+        self.children = children
+
+
+class _SpanParser(Parser):
+    """A Parser that records the _Span of every ProcedureDecl and
+    Compound node, see IncrementalParser."""
+    def __init__(self, lexer):
+        # the children of the spans that are being parsed
+        self.spans = [[]]
+        super().__init__(lexer)
+
+    def _parse_span(self, parse):
+        start = self.current_token.pos
+        self.spans.append([])
+        node = parse()
+        children = self.spans.pop()
+        end = self.current_token.pos
+        if end is None:
+            end = self.lexer.end  # EOF
+        self.spans[-1].append(_Span(node, start, end, children))
+        return node
+
+    def procedure_declaration(self):
+        return self._parse_span(super().procedure_declaration)
+
+    def compound_statement(self):
+        return self._parse_span(super().compound_statement)
+
+
+def _replace_child(parent, old, new):
+    """Replace `old`, a child of the Program, ProcedureDecl or Compound
+    node `parent`, with `new`."""
+    if isinstance(parent, Compound):
+        children = parent.children
+    else:
+        if isinstance(parent, Program):
+            block = parent.block
+        else:
+            block = parent.block_node
+        if block.compound_statement is old:
+            block.compound_statement = new
+            return
+        children = block.declarations
+    children[children.index(old)] = new
+
+
+class IncrementalParser:
+    """Keeps the AST of a source text up to date while the text is edited.
+
+        parser = IncrementalParser(text)
+        tree = parser.parse()
+        tree = parser.edit(offset, removed, inserted)
+
+    An edit relexes and reparses only the innermost procedure
+    declaration or compound statement that encloses it; all other nodes
+    of the tree stay the same objects. Tokens keep their offsets and
+    LineIndex, which forwards positions to the index of the edited text;
+    every `rebase_interval` edits the tokens are moved to the index of
+    the current text, so that the chain of forwarding indexes stays
+    short. The tree is not analyzed, run the SemanticAnalyzer over it
+    again.
+    """
+    rebase_interval = 256
+
+    def __init__(self, text):
+        self.text = text
+        self.names = NameTable()
+        self.lines = LineIndex(text)
+        self.tree = None
+        # the spans of the nodes of the program, see _SpanParser
+        self._spans = None
+        # edits since the tokens of the tree were moved to self.lines
+        self._forwarded = 0
+
+    def _make_parser(self, start, end):
+        lexer = RegexLexer(self.text, self.names, start, end)
+        # the tokens of all parses resolve positions in the current text
+        lexer.lines = self.lines
+        return _SpanParser(lexer)
+
+    def parse(self):
+        """Parse the whole text and return the tree."""
+        self.tree = self._spans = None
+        parser = self._make_parser(0, len(self.text))
+        self.tree = parser.parse()
+        self._spans = parser.spans[0]
+        self._forwarded = 0
+        return self.tree
+
+    def edit(self, offset, removed, inserted):
+        """Replace `removed` characters at `offset` with the text
+        `inserted` and return the updated tree.
+
+        Raises LexerError or ParserError if the edited text is not a
+        valid program; the whole text is parsed again on the next edit.
+        """
+        edit_end = offset + removed
+        delta = len(inserted) - removed
+        self.text = self.text[:offset] + inserted + self.text[edit_end:]
+        lines = LineIndex(self.text)
+        self.lines.forward(lines, edit_end, delta)
+        self.lines = lines
+        if self.tree is None:
+            return self.parse()
+        self._forwarded += 1
+        if self._forwarded >= self.rebase_interval:
+            self._rebase()
+
+        # the spans around the edit, the outermost first
+        path = []
+        spans = self._spans
+        while spans:
+            for span in spans:
+                if span.start < offset and edit_end < span.end:
+                    path.append(span)
+                    spans = span.children
+                    break
+            else:
+                break
+        self._shift(self._spans, edit_end, delta)
+
+        for depth in reversed(range(len(path))):
+            span = path[depth]
+            new_span = self._reparse(span)
+            if new_span is None:
+                continue
+            if depth:
+                parent = path[depth - 1].node
+                siblings = path[depth - 1].children
+            else:
+                parent, siblings = self.tree, self._spans
+            _replace_child(parent, span.node, new_span.node)
+            siblings[siblings.index(span)] = new_span
+            return self.tree
+
+        return self.parse()
+
+    def _rebase(self):
+        """Move the tokens of the tree to the index of the current text.
+
+        Tokens of older texts resolve their positions through a chain of
+        indexes, one per edit, that they keep alive; see
+        LineIndex.forward.
+        """
+        # the tokens of the tree by the index of their text
+        tokens = collections.defaultdict(list)
+        nodes = [self.tree]
+        with _gc_paused():
+            while nodes:
+                node = nodes.pop()
+                for token in (
+                    getattr(node, 'token', None), getattr(node, 'op', None),
+                ):
+                    if token is not None and token.lines is not None:
+                        tokens[token.lines].append(token)
+                nodes.extend(_ast_children(node))
+        tokens.pop(self.lines, None)
+
+        for lines, stale in tokens.items():
+            offsets = sorted({token.pos for token in stale})
+            current, resolved = lines.resolve_many(offsets)
+            moved = dict(zip(offsets, resolved))
+            for token in stale:
+                token.pos = moved[token.pos]
+                token.lines = current
+        self._forwarded = 0
+
+    def _shift(self, spans, edit_end, delta):
+        """Move the spans after the edit, stretch the ones around it."""
+        for span in spans:
+            if span.start >= edit_end:
+                span.start += delta
+                span.end += delta
+            elif span.end > edit_end:
+                span.end += delta
+            else:
+                continue
+            self._shift(span.children, edit_end, delta)
+
+    def _reparse(self, span):
+        """Parse the text of the span again into a node of the same
+        kind. Returns the new span or None if the text does not parse
+        into exactly one such node."""
+        parser = self._make_parser(span.start, span.end)
+        try:
+            if isinstance(span.node, ProcedureDecl):
+                parser.procedure_declaration()
+            else:
+                parser.compound_statement()
+            if parser.current_token.type != TokenType.EOF:
+                return None
+        except (LexerError, ParserError):
+            return None
+        return parser.spans[0][0]
+
+
+###############################################################################
+#                                                                             #
+#  FLAT AST                                                                   #
+#                                                                             #
+###############################################################################
+
+class FlatNode:
+    """View of a node of a FlatTree.
+
+    A view has the fields of the AST class of the node and the class of
+    the view has the name of the AST class, so NodeVisitor subclasses
+    visit views with their visit_ methods. Views are made on access;
+    two views of the same node compare equal.
+    """
+    __slots__ = ('tree', 'index')
+
+    def __init__(self, tree, index):
+        self.tree = tree
+        self.index = index
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, FlatNode)
+            and self.tree is other.tree
+            and self.index == other.index
+        )
+
+    def __hash__(self):
+        return self.index
+
+    def __repr__(self):
+        return f'<flat {type(self).__name__} {self.index}>'
+
+    def __reduce__(self):
+        # the view classes cannot be found by name
+        kind_code = _FLAT_VIEW_CLASSES.index(type(self))
+        return _flat_node, (kind_code, self.tree, self.index)
+
+    # field getters, see _flat_view
+
+    def _children(self, start=0, stop=0):
+        tree = self.tree
+        first = tree.child_starts[self.index] + start
+        last = tree.child_starts[self.index + 1] + stop
+        return [tree.node(child) for child in tree.children[first:last]]
+
+    def _first(self):
+        tree = self.tree
+        return tree.node(tree.children[tree.child_starts[self.index]])
+
+    def _second(self):
+        tree = self.tree
+        return tree.node(tree.children[tree.child_starts[self.index] + 1])
+
+    def _last(self):
+        tree = self.tree
+        return tree.node(tree.children[tree.child_starts[self.index + 1] - 1])
+
+    def _leading(self):
+        return self._children(stop=-1)
+
+    def _token(self):
+        return self.tree.token(self.index)
+
+    def _name(self):
+        return self.tree.names[self.tree.values[self.index]]
+
+    def _literal(self):
+        return self.tree.literals[self.tree.values[self.index]]
+
+
+def _annotation(name):
+    """Return the (getter, setter) pair of a field that the analysis
+    sets, kept in FlatTree.annotations."""
+    def get(node):
+        return node.tree.annotations.get((name, node.index))
+
+    def set(node, value):
+        node.tree.annotations[name, node.index] = value
+
+    return get, set
+
+
+def _flat_view(kind, **fields):
+    """Create the FlatNode view class of the AST class `kind`.
+
+    `fields` maps the names of the fields of `kind` to their getters or
+    (getter, setter) pairs.
+    """
+    namespace = {'__slots__': ()}
+    for name, accessors in fields.items():
+        if not isinstance(accessors, tuple):
+            accessors = (accessors,)
+        namespace[name] = property(*accessors)
+    return type(kind.__name__, (FlatNode,), namespace)
+
+
+# AST class -> the class of its FlatNode views
+_FLAT_VIEWS = {
+    Program: _flat_view(
+        Program, name=FlatNode._name, block=FlatNode._first,
+        variables=_annotation('variables'),
+    ),
+    Block: _flat_view(
+        Block, declarations=FlatNode._leading,
+        compound_statement=FlatNode._last,
+    ),
+    VarDecl: _flat_view(
+        VarDecl, var_node=FlatNode._first, type_node=FlatNode._second,
+    ),
+    Type: _flat_view(Type, token=FlatNode._token, value=FlatNode._name),
+    Param: _flat_view(
+        Param, var_node=FlatNode._first, type_node=FlatNode._second,
+    ),
+    ProcedureDecl: _flat_view(
+        ProcedureDecl, proc_name=FlatNode._name,
+        formal_params=FlatNode._leading, block_node=FlatNode._last,
+    ),
+    ProcedureCall: _flat_view(
+        ProcedureCall, proc_name=FlatNode._name,
+        actual_params=FlatNode._children, token=FlatNode._token,
+        proc_symbol=_annotation('proc_symbol'),
+    ),
+    Compound: _flat_view(Compound, children=FlatNode._children),
+    Assign: _flat_view(
+        Assign, left=FlatNode._first, op=FlatNode._token,
+        right=FlatNode._second,
+    ),
+    BinOp: _flat_view(
+        BinOp, left=FlatNode._first, op=FlatNode._token,
+        right=FlatNode._second, eval_type=_annotation('eval_type'),
+    ),
+    UnaryOp: _flat_view(
+        UnaryOp, op=FlatNode._token, expr=FlatNode._first,
+        eval_type=_annotation('eval_type'),
+    ),
+    Num: _flat_view(
+        Num, token=FlatNode._token, value=FlatNode._literal,
+        eval_type=_annotation('eval_type'),
+    ),
+    Var: _flat_view(
+        Var, token=FlatNode._token, value=FlatNode._name,
+        address=_annotation('address'), eval_type=_annotation('eval_type'),
+    ),
+    NoOp: _flat_view(NoOp),
+}
+
+# the AST classes in the order of their kind codes in a FlatTree
+_NODE_KINDS = tuple(_FLAT_VIEWS)
+_NODE_KIND_CODES = {kind: code for code, kind in enumerate(_NODE_KINDS)}
+_FLAT_VIEW_CLASSES = tuple(_FLAT_VIEWS.values())
+
+
+def _flat_node(kind_code, tree, index):
+    return _FLAT_VIEW_CLASSES[kind_code](tree, index)
+
+
+# the value of FlatTree.positions for a node without a position
+_NO_POSITION = 0xFFFFFFFF
+
+
+def _align(offset):
+    """Round the offset up to a multiple of 8."""
+    return (offset + 7) & ~7
+
+
+class FlatTree:
+    """An AST stored as a struct of arrays.
+
+    Every node has an index and, in parallel arrays, a kind code (an
+    index into _NODE_KINDS), a token type code of its operator, keyword
+    or literal, a value index and the offset of its token. The value
+    index of a name (of a variable, type, procedure or the program) is
+    its id in self.names and that of a number is its index in the
+    self.literals pool. The children of node i are the node indexes
+    self.children[self.child_starts[i]:self.child_starts[i + 1]], in the
+    order of the fields of the AST class; children come before their
+    parent and the root is the last node.
+
+    Build a FlatTree with flatten(). tree.root() returns a view of the
+    root that NodeVisitor subclasses walk like an AST, see FlatNode.
+    tobytes() and frombuffer() serialize the syntax of a tree;
+    frombuffer() does not copy the arrays, so a tree can be read from
+    an mmap. The fields that the SemanticAnalyzer sets are kept in
+    self.annotations and are not serialized.
+    """
+    # the names of the arrays, in the order tobytes() writes them
+    _ARRAYS = (
+        'kinds', 'types', 'values', 'positions', 'child_starts', 'children',
+    )
+
+    def __init__(self, lines=None):
+        self.lines = lines
+        self.kinds = array('B')      # _NODE_KIND_CODES values
+        self.types = array('B')      # _TOKEN_TYPE_CODES values
+        self.values = array('I')     # name ids and indexes into literals
+        self.positions = array('I')  # offsets of tokens or _NO_POSITION
+        self.child_starts = array('I', [0])
+        self.children = array('I')
+        self.names = []
+        self.literals = []
+        # name -> name id, while the tree is built
+        self._name_ids = {}
+        # (field name, node index) -> value of a field set by the analysis
+        self.annotations = {}
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in self._ARRAYS:
+            data = state[name]
+            if isinstance(data, memoryview):
+                # the arrays of a tree read by frombuffer
+                state[name] = array(data.format, data.tobytes())
+        return state
+
+    def _name_id(self, name):
+        name_id = self._name_ids.get(name)
+        if name_id is None:
+            name_id = self._name_ids[name] = len(self.names)
+            self.names.append(name)
+        return name_id
+
+    def append(self, node, children):
+        """Add a node (an AST node or a FlatNode view) whose children are
+        already in the tree, given by their indexes, and return its
+        index."""
+        kind = _node_kind(node)
+        token_type = value = 0
+        token = None
+        if kind in (Program, ProcedureDecl):
+            name = node.name if kind is Program else node.proc_name
+            value = self._name_id(name)
+        elif kind is ProcedureCall:
+            value = self._name_id(node.proc_name)
+            token = node.token
+        elif kind in (Var, Type):
+            value = self._name_id(node.value)
+            token = node.token
+        elif kind is Num:
+            value = len(self.literals)
+            self.literals.append(node.value)
+            token = node.token
+        elif kind in (Assign, BinOp, UnaryOp):
+            token = node.op
+        if token is not None:
+            token_type = _TOKEN_TYPE_CODES[token.type]
+            if self.lines is None:
+                self.lines = token.lines
+        self.kinds.append(_NODE_KIND_CODES[kind])
+        self.types.append(token_type)
+        self.values.append(value)
+        if token is None or token.pos is None:
+            self.positions.append(_NO_POSITION)
+        else:
+            self.positions.append(token.pos)
+        self.children.extend(children)
+        self.child_starts.append(len(self.children))
+        return len(self.kinds) - 1
+
+    def node(self, index):
+        """Return the view of the node with the given index."""
+        return _FLAT_VIEW_CLASSES[self.kinds[index]](self, index)
+
+    def root(self):
+        return self.node(len(self.kinds) - 1)
+
+    def token(self, index):
+        """Materialize the token of the node with the given index."""
+        token_type = _TOKEN_TYPES[self.types[index]]
+        pos, lines = self.positions[index], self.lines
+        if pos == _NO_POSITION:
+            pos = lines = None
+        if token_type in (TokenType.INTEGER_CONST, TokenType.REAL_CONST):
+            value = self.literals[self.values[index]]
+        elif token_type in (TokenType.ID, TokenType.INTEGER, TokenType.REAL):
+            value = self.names[self.values[index]]
+        else:
+            value = token_type.value
+        return Token(token_type, value, pos, lines)
+
+    def tobytes(self):
+        """Serialize the tree (but not its LineIndex)."""
+        header = pickle.dumps(
+            (self.names, self.literals, len(self.kinds), len(self.children)),
+            protocol=pickle.HIGHEST_PROTOCOL,
+        )
+        parts = [len(header).to_bytes(8, 'little'), header]
+        size = 8 + len(header)
+        for name in self._ARRAYS:
+            data = bytes(getattr(self, name))
+            parts.append(bytes(_align(size) - size))
+            parts.append(data)
+            size = _align(size) + len(data)
+        return b''.join(parts)
+
+    @classmethod
+    def frombuffer(cls, data, lines):
+        """Return the tree serialized by tobytes() in `data`, a bytes-like
+        object, its tokens linked to `lines`.
+
+        The arrays of the tree are memoryviews of `data`.
+        """
+        data = memoryview(data)
+        size = int.from_bytes(data[:8], 'little')
+        names, literals, count, children = pickle.loads(data[8:8 + size])
+        tree = cls(lines)
+        tree.names = names
+        tree.literals = literals
+        offset = 8 + size
+        lengths = (count, count, count, count, count + 1, children)
+        for name, length in zip(cls._ARRAYS, lengths):
+            typecode = getattr(tree, name).typecode
+            offset = _align(offset)
+            end = offset + length * array(typecode).itemsize
+            setattr(tree, name, data[offset:end].cast(typecode))
+            offset = end
+        return tree
+
+
+def _node_kind(node):
+    """Return the AST class of an AST node or of a FlatNode view."""
+    if isinstance(node, FlatNode):
+        return _NODE_KINDS[node.tree.kinds[node.index]]
+    return type(node)
+
+
+def _ast_children(node):
+    """Return the child nodes of an AST node in the order of its fields."""
+    kind = _node_kind(node)
+    if kind is Program:
+        return [node.block]
+    if kind is Block:
+        return node.declarations + [node.compound_statement]
+    if kind in (VarDecl, Param):
+        return [node.var_node, node.type_node]
+    if kind is ProcedureDecl:
+        return node.formal_params + [node.block_node]
+    if kind is ProcedureCall:
+        return node.actual_params
+    if kind is Compound:
+        return node.children
+    if kind in (Assign, BinOp):
+        return [node.left, node.right]
+    if kind is UnaryOp:
+        return [node.expr]
+    return []
+
+
+def flatten(tree):
+    """Return the FlatTree of an AST built by a Parser.
+
+    The blocks of a LazyParser tree are parsed on the way. Nodes shared
+    by a HashConsingParser stay shared: they are stored once and are
+    the children of all their parents. The tree may contain FlatNode
+    views, like the blocks of a parse_parallel tree.
+    """
+    flat = FlatTree()
+    # indexes of the flattened nodes whose parent is not flattened yet
+    done = []
+    # node -> index of every flattened node
+    indexes = {}
+    stack = [(tree, None)]
+    with _gc_paused():
+        while stack:
+            node, children = stack.pop()
+            if isinstance(node, LazyBlock):
+                node = node.block or node.parse()
+            if children is None:
+                if node in indexes:
+                    done.append(indexes[node])
+                    continue
+                children = _ast_children(node)
+                stack.append((node, children))
+                stack.extend((child, None) for child in reversed(children))
+            else:
+                first = len(done) - len(children)
+                index = indexes[node] = flat.append(node, done[first:])
+                del done[first:]
+                done.append(index)
+    return flat
+
+
+###############################################################################
+#                                                                             #
+#  AST visitors (walkers)                                                     #
+#                                                                             #
+###############################################################################
+
+class NodeVisitor:
+    def visit(self, node):
+        method_name = 'visit_' + type(node).__name__
+        visitor = getattr(self, method_name, self.generic_visit)
+        return visitor(node)
+
+    def generic_visit(self, node):
+        raise Exception('No visit_{} method'.format(type(node).__name__))
+
+
+###############################################################################
+#                                                                             #
+#  SYMBOLS, TABLES, SEMANTIC ANALYSIS                                         #
+#                                                                             #
+###############################################################################
+
+class Symbol:
+    def __init__(self, name, type=None):
+        self.name = name
+        self.type = type
+        self.scope_level = 0
 
 
 class VarSymbol(Symbol):
     def __init__(self, name, type):
         super().__init__(name, type)
+        # index of the variable in the ActivationRecord of its scope
+        self.slot = None
 
     def __str__(self):
         return "<{class_name}(name='{name}', type='{type}')>".format(
@@ -822,6 +2637,13 @@ class ProcedureSymbol(Symbol):
         self.formal_params = [] if formal_params is None else formal_params
         # a reference to procedure's body (AST sub-tree)
         self.block_ast = None
+        # the VarSymbols of the parameters and local variables by slot
+        self.variables = []
+
+    @property
+    def frame_size(self):
+        """The number of slots of the procedure's ActivationRecord."""
+        return len(self.variables)
 
     def __str__(self):
         return '<{class_name}(name={name}, parameters={params})>'.format(
@@ -833,12 +2655,39 @@ class ProcedureSymbol(Symbol):
     __repr__ = __str__
 
 
+class ErrorSymbol(Symbol):
+    """Stands for a name that is not declared, once its error has been
+    recorded, see SemanticAnalyzer.analyze_with_recovery."""
+    def __init__(self, name):
+        super().__init__(name)
+        self.slot = None
+
+    def __str__(self):
+        return "<{class_name}(name='{name}')>".format(
+            class_name=self.__class__.__name__,
+            name=self.name,
+        )
+
+    __repr__ = __str__
+
+
 class ScopedSymbolTable:
     def __init__(self, scope_name, scope_level, enclosing_scope=None):
         self._symbols = {}
         self.scope_name = scope_name
         self.scope_level = scope_level
         self.enclosing_scope = enclosing_scope
+        # the VarSymbols of the scope, in the order of their slots
+        self.variables = []
+        # name -> (symbol or None, epoch) of the names looked up in this
+        # scope and the scopes that enclose it, see lookup
+        self._resolved = {}
+        # name -> number of inserts of the name, shared by all the scopes
+        # of a program: a resolution is valid while its epoch is current
+        if enclosing_scope is None:
+            self._epochs = {}
+        else:
+            self._epochs = enclosing_scope._epochs
 
     def _init_builtins(self):
         self.insert(BuiltinTypeSymbol('INTEGER'))
@@ -867,45 +2716,95 @@ class ScopedSymbolTable:
 
     __repr__ = __str__
 
-    def log(self, msg):
+    def log(self, msg, *args):
+        """Print msg.format(*args) with --scope. The message is only
+        formatted when it is printed."""
         if _SHOULD_LOG_SCOPE:
-            print(msg)
+            print(msg.format(*args) if args else msg)
 
     def insert(self, symbol):
-        self.log(f'Insert: {symbol.name}')
+        self.log('Insert: {}', symbol.name)
         symbol.scope_level = self.scope_level
+        if isinstance(symbol, VarSymbol):
+            symbol.slot = len(self.variables)
+            self.variables.append(symbol)
         self._symbols[symbol.name] = symbol
+        # the name may now resolve to this symbol where it did not
+        self._epochs[symbol.name] = self._epochs.get(symbol.name, 0) + 1
 
     def lookup(self, name, current_scope_only=False):
-        self.log(f'Lookup: {name}. (Scope name: {self.scope_name})')
-        # 'symbol' is either an instance of the Symbol class or None
-        symbol = self._symbols.get(name)
-
-        if symbol is not None:
-            return symbol
-
+        """Return the symbol of the name in this scope or, unless
+        `current_scope_only` is set, in the closest enclosing scope that
+        has one, or None.
+
+        Resolutions are remembered in every scope, so a name is found
+        without going up the chain again. A resolution is used as long
+        as the name has not been inserted anywhere since: inserts can
+        shadow it.
+        """
         if current_scope_only:
-            return None
-
-        # recursively go up the chain and lookup the name
-        if self.enclosing_scope is not None:
-            return self.enclosing_scope.lookup(name)
+            self.log('Lookup: {}. (Scope name: {})', name, self.scope_name)
+            return self._symbols.get(name)
+
+        epoch = self._epochs.get(name, 0)
+        scope = self
+        while scope is not None:
+            scope.log('Lookup: {}. (Scope name: {})', name, scope.scope_name)
+            symbol = scope._symbols.get(name)
+            if symbol is not None:
+                break
+            resolved = scope._resolved.get(name)
+            if resolved is not None and resolved[1] == epoch:
+                symbol = resolved[0]
+                break
+            scope = scope.enclosing_scope
+
+        self._resolved[name] = (symbol, epoch)
+        return symbol
 
 
 class SemanticAnalyzer(NodeVisitor):
     def __init__(self):
         self.current_scope = None
-
-    def log(self, msg):
+        # collect semantic errors instead of stopping at the first one
+        self.recovering = False
+        self.errors = []
+        # (error code, token offset) of the errors, see error()
+        self._reported = set()
+
+    def log(self, msg, *args):
+        """Print msg.format(*args) with --scope, see
+        ScopedSymbolTable.log."""
         if _SHOULD_LOG_SCOPE:
-            print(msg)
+            print(msg.format(*args) if args else msg)
 
     def error(self, error_code, token):
-        raise SemanticError(
+        error = SemanticError(
             error_code=error_code,
             token=token,
             message=f'{error_code.value} -> {token}',
         )
+        if not self.recovering:
+            raise error
+        # a node shared by a HashConsingParser is visited once for
+        # every occurrence, but its errors are reported once
+        key = (error_code, token.pos)
+        if key not in self._reported:
+            self._reported.add(key)
+            self.errors.append(error)
+
+    def analyze_with_recovery(self, tree):
+        """Analyze the tree and collect all semantic errors.
+
+        A duplicate declaration is left out of its scope. A name that is
+        not found is declared in the current scope with an ErrorSymbol,
+        so its other uses there are not reported again. Returns the list
+        of SemanticError exceptions in source order. The blocks of a
+        LazyParser tree are not analyzed until they are called.
+        """
+        self.recovering = True
+        self.visit(tree)
+        return sorted(self.errors, key=lambda error: error.token.position())
 
     def visit_Block(self, node):
         for declaration in node.declarations:
@@ -924,6 +2823,8 @@ class SemanticAnalyzer(NodeVisitor):
 
         # visit subtree
         self.visit(node.block)
+        # the layout of the program's ActivationRecord
+        node.variables = global_scope.variables
 
         self.log(global_scope)
 
@@ -946,7 +2847,7 @@ class SemanticAnalyzer(NodeVisitor):
         proc_symbol = ProcedureSymbol(proc_name)
         self.current_scope.insert(proc_symbol)
 
-        self.log(f'ENTER scope: {proc_name}')
+        self.log('ENTER scope: {}', proc_name)
         # Scope for parameters and local variables
         procedure_scope = ScopedSymbolTable(
             scope_name=proc_name,
@@ -954,6 +2855,9 @@ class SemanticAnalyzer(NodeVisitor):
             enclosing_scope=self.current_scope
         )
         self.current_scope = procedure_scope
+        # the layout of the procedure's ActivationRecords, complete when
+        # the block has been analyzed (see LazyBlock)
+        proc_symbol.variables = procedure_scope.variables
 
         # Insert parameters into the procedure scope
         for param in node.formal_params:
@@ -968,11 +2872,20 @@ class SemanticAnalyzer(NodeVisitor):
         self.log(procedure_scope)
 
         self.current_scope = self.current_scope.enclosing_scope
-        self.log(f'LEAVE scope: {proc_name}')
+        self.log('LEAVE scope: {}', proc_name)
 
         # accessed by the interpreter when executing procedure call
         proc_symbol.block_ast = node.block_node
 
+    def visit_LazyBlock(self, node):
+        if node.block is not None:
+            self.visit(node.block)
+        else:
+            # analyzed when the procedure is first called,
+            # see Interpreter.visit_LazyBlock
+            node.scope = self.current_scope
+            node.analyzer = type(self)
+
     def visit_VarDecl(self, node):
         type_name = node.type_node.value
         type_symbol = self.current_scope.lookup(type_name)
@@ -989,6 +2902,8 @@ class SemanticAnalyzer(NodeVisitor):
                 error_code=ErrorCode.DUPLICATE_ID,
                 token=node.var_node.token,
             )
+            # recovering: keep the first declaration
+            return
 
         self.current_scope.insert(var_symbol)
 
@@ -1003,22 +2918,132 @@ class SemanticAnalyzer(NodeVisitor):
         var_symbol = self.current_scope.lookup(var_name)
         if var_symbol is None:
             self.error(error_code=ErrorCode.ID_NOT_FOUND, token=node.token)
+            # recovering: report the name once in this scope
+            var_symbol = ErrorSymbol(var_name)
+            self.current_scope.insert(var_symbol)
+        elif not isinstance(var_symbol, (VarSymbol, ErrorSymbol)):
+            # a procedure or type name used as a variable
+            self.error(error_code=ErrorCode.NOT_A_VARIABLE, token=node.token)
+            # recovering: the node gets no address
+            return ErrorSymbol(var_name)
+        # accessed by the interpreter instead of the name
+        node.address = (
+            self.current_scope.scope_level - var_symbol.scope_level,
+            var_symbol.slot,
+        )
+        return var_symbol
 
     def visit_Num(self, node):
         pass
 
     def visit_UnaryOp(self, node):
-        pass
+        self.visit(node.expr)
 
     def visit_ProcedureCall(self, node):
         for param_node in node.actual_params:
             self.visit(param_node)
 
         proc_symbol = self.current_scope.lookup(node.proc_name)
+        if proc_symbol is None:
+            self.error(error_code=ErrorCode.ID_NOT_FOUND, token=node.token)
+        elif not isinstance(proc_symbol, (ProcedureSymbol, ErrorSymbol)):
+            # a variable or type name called as a procedure
+            self.error(error_code=ErrorCode.NOT_A_PROCEDURE, token=node.token)
+        if not isinstance(proc_symbol, ProcedureSymbol):
+            # recovering: the call is not checked any further
+            proc_symbol = None
         # accessed by the interpreter when executing procedure call
         node.proc_symbol = proc_symbol
 
 
+def _expr_token(node):
+    """Return the token of the first operand of an expression, which
+    unlike an operator token always has a position.
+
+    Only Num and Var nodes (or FlatNode views of them) have a token.
+    """
+    while not hasattr(node, 'token'):
+        node = node.expr if hasattr(node, 'expr') else node.left
+    return node.token
+
+
+class TypeChecker(SemanticAnalyzer):
+    """A SemanticAnalyzer that also infers and checks the types of
+    expressions.
+
+    Every BinOp, UnaryOp, Num and Var node gets the name of its type,
+    'INTEGER' or 'REAL', in eval_type; the visit methods of expressions
+    return it. `/` yields a REAL, DIV an INTEGER and needs INTEGER
+    operands, and the other operators yield a REAL if either operand is
+    one. An INTEGER can be assigned or passed to a REAL variable but not
+    the other way around. Mismatches are TYPE_MISMATCH errors.
+
+    The type of an expression with an undeclared name or an unknown
+    type is None and it is not checked any further.
+    """
+    def visit_Num(self, node):
+        if node.token.type == TokenType.INTEGER_CONST:
+            node.eval_type = 'INTEGER'
+        else:
+            node.eval_type = 'REAL'
+        return node.eval_type
+
+    def visit_Var(self, node):
+        type_symbol = super().visit_Var(node).type
+        node.eval_type = type_symbol.name if type_symbol else None
+        return node.eval_type
+
+    def visit_UnaryOp(self, node):
+        node.eval_type = self.visit(node.expr)
+        return node.eval_type
+
+    def visit_BinOp(self, node):
+        left = self.visit(node.left)
+        right = self.visit(node.right)
+        op = node.op.type
+        if op == TokenType.INTEGER_DIV:
+            for operand, operand_type in (
+                (node.left, left), (node.right, right),
+            ):
+                if operand_type == 'REAL':
+                    self.error(
+                        error_code=ErrorCode.TYPE_MISMATCH,
+                        token=_expr_token(operand),
+                    )
+            node.eval_type = 'INTEGER'
+        elif left is None or right is None:
+            node.eval_type = None
+        elif op == TokenType.FLOAT_DIV or 'REAL' in (left, right):
+            node.eval_type = 'REAL'
+        else:
+            node.eval_type = 'INTEGER'
+        return node.eval_type
+
+    def check_assignment(self, var_type, node):
+        """Check that the value of the expression `node` can be stored
+        in a variable of the type named `var_type`."""
+        if var_type == 'INTEGER' and node.eval_type == 'REAL':
+            self.error(
+                error_code=ErrorCode.TYPE_MISMATCH,
+                token=_expr_token(node),
+            )
+
+    def visit_Assign(self, node):
+        self.visit(node.right)
+        self.check_assignment(self.visit(node.left), node.right)
+
+    def visit_ProcedureCall(self, node):
+        super().visit_ProcedureCall(node)
+        if not isinstance(node.proc_symbol, ProcedureSymbol):
+            return
+        for param_symbol, argument_node in zip(
+            node.proc_symbol.formal_params, node.actual_params
+        ):
+            param_type = param_symbol.type
+            if param_type is not None:
+                self.check_assignment(param_type.name, argument_node)
+
+
 ###############################################################################
 #                                                                             #
 #  INTERPRETER                                                                #
@@ -1026,6 +3051,35 @@ class SemanticAnalyzer(NodeVisitor):
 ###############################################################################
 
 
+def _float_div(left, right):
+    return float(left) / float(right)
+
+
+# The operations of the binary operators by operator and the eval_type
+# of the BinOp node. An unchecked node (eval_type None) can have
+# operands of either type; `/` of checked numbers needs no conversions.
+_BINARY_OPERATIONS = {
+    (TokenType.PLUS, None): operator.add,
+    (TokenType.MINUS, None): operator.sub,
+    (TokenType.MUL, None): operator.mul,
+    (TokenType.INTEGER_DIV, None): operator.floordiv,
+    (TokenType.FLOAT_DIV, None): _float_div,
+    (TokenType.PLUS, 'INTEGER'): operator.add,
+    (TokenType.MINUS, 'INTEGER'): operator.sub,
+    (TokenType.MUL, 'INTEGER'): operator.mul,
+    (TokenType.INTEGER_DIV, 'INTEGER'): operator.floordiv,
+    (TokenType.PLUS, 'REAL'): operator.add,
+    (TokenType.MINUS, 'REAL'): operator.sub,
+    (TokenType.MUL, 'REAL'): operator.mul,
+    (TokenType.FLOAT_DIV, 'REAL'): operator.truediv,
+}
+
+_UNARY_OPERATIONS = {
+    TokenType.PLUS: operator.pos,
+    TokenType.MINUS: operator.neg,
+}
+
+
 class ARType(Enum):
     PROGRAM   = 'PROGRAM'
     PROCEDURE = 'PROCEDURE'
@@ -1054,14 +3108,39 @@ class CallStack:
 
 
 class ActivationRecord:
-    def __init__(self, name, type, nesting_level):
+    """The values of the variables of one activation of a scope.
+
+    The values are kept in self.slots, in the order of the VarSymbols in
+    `variables`: the interpreter reads and writes them by the address
+    of a Var node (see SemanticAnalyzer.visit_Var), following the
+    `enclosing` links to the records of the enclosing scopes. Indexing
+    by name is for debugging and tests.
+    """
+    def __init__(self, name, type, nesting_level, variables=(),
+                 enclosing=None):
         self.name = name
         self.type = type
         self.nesting_level = nesting_level
-        self.members = {}
+        self.variables = variables
+        self.slots = [None] * len(variables)
+        # the record of the enclosing scope (the access link)
+        self.enclosing = enclosing
+
+    @property
+    def members(self):
+        """A dictionary of the variables that have a value."""
+        return {
+            var_symbol.name: value
+            for var_symbol, value in zip(self.variables, self.slots)
+            if value is not None
+        }
 
     def __setitem__(self, key, value):
-        self.members[key] = value
+        for var_symbol in self.variables:
+            if var_symbol.name == key:
+                self.slots[var_symbol.slot] = value
+                return
+        raise KeyError(key)
 
     def __getitem__(self, key):
         return self.members[key]
@@ -1092,27 +3171,31 @@ class Interpreter(NodeVisitor):
         self.tree = tree
         self.call_stack = CallStack()
 
-    def log(self, msg):
+    def log(self, msg, *args):
+        """Print msg.format(*args) with --stack. The message (or the
+        call stack, passed as msg) is only formatted when it is
+        printed."""
         if _SHOULD_LOG_STACK:
-            print(msg)
+            print(msg.format(*args) if args else msg)
 
     def visit_Program(self, node):
         program_name = node.name
-        self.log(f'ENTER: PROGRAM {program_name}')
+        self.log('ENTER: PROGRAM {}', program_name)
 
         ar = ActivationRecord(
             name=program_name,
             type=ARType.PROGRAM,
             nesting_level=1,
+            variables=node.variables,
         )
         self.call_stack.push(ar)
 
-        self.log(str(self.call_stack))
+        self.log(self.call_stack)
 
         self.visit(node.block)
 
-        self.log(f'LEAVE: PROGRAM {program_name}')
-        self.log(str(self.call_stack))
+        self.log('LEAVE: PROGRAM {}', program_name)
+        self.log(self.call_stack)
 
         self.call_stack.pop()
 
@@ -1130,45 +3213,38 @@ class Interpreter(NodeVisitor):
         pass
 
     def visit_BinOp(self, node):
-        if node.op.type == TokenType.PLUS:
-            return self.visit(node.left) + self.visit(node.right)
-        elif node.op.type == TokenType.MINUS:
-            return self.visit(node.left) - self.visit(node.right)
-        elif node.op.type == TokenType.MUL:
-            return self.visit(node.left) * self.visit(node.right)
-        elif node.op.type == TokenType.INTEGER_DIV:
-            return self.visit(node.left) // self.visit(node.right)
-        elif node.op.type == TokenType.FLOAT_DIV:
-            return float(self.visit(node.left)) / float(self.visit(node.right))
+        operation = _BINARY_OPERATIONS[node.op.type, node.eval_type]
+        return operation(self.visit(node.left), self.visit(node.right))
 
     def visit_Num(self, node):
         return node.value
 
     def visit_UnaryOp(self, node):
-        op = node.op.type
-        if op == TokenType.PLUS:
-            return +self.visit(node.expr)
-        elif op == TokenType.MINUS:
-            return -self.visit(node.expr)
+        return _UNARY_OPERATIONS[node.op.type](self.visit(node.expr))
 
     def visit_Compound(self, node):
         for child in node.children:
             self.visit(child)
 
     def visit_Assign(self, node):
-        var_name = node.left.value
+        depth, slot = node.left.address
         var_value = self.visit(node.right)
 
         ar = self.call_stack.peek()
-        ar[var_name] = var_value
+        while depth:
+            ar = ar.enclosing
+            depth -= 1
+        ar.slots[slot] = var_value
 
     def visit_Var(self, node):
-        var_name = node.value
+        depth, slot = node.address
 
         ar = self.call_stack.peek()
-        var_value = ar.get(var_name)
+        while depth:
+            ar = ar.enclosing
+            depth -= 1
 
-        return var_value
+        return ar.slots[slot]
 
     def visit_NoOp(self, node):
         pass
@@ -1176,32 +3252,51 @@ class Interpreter(NodeVisitor):
     def visit_ProcedureDecl(self, node):
         pass
 
+    def visit_LazyBlock(self, node):
+        if node.block is None:
+            block = node.parse()
+            semantic_analyzer = node.analyzer()
+            semantic_analyzer.current_scope = node.scope
+            semantic_analyzer.visit(block)
+            node.block = block
+            # make room for the local variables found in the block
+            ar = self.call_stack.peek()
+            ar.slots.extend([None] * (len(ar.variables) - len(ar.slots)))
+        self.visit(node.block)
+
     def visit_ProcedureCall(self, node):
         proc_name = node.proc_name
         proc_symbol = node.proc_symbol
 
+        # the record of the scope the procedure is declared in
+        enclosing = self.call_stack.peek()
+        for _ in range(enclosing.nesting_level - proc_symbol.scope_level):
+            enclosing = enclosing.enclosing
+
         ar = ActivationRecord(
             name=proc_name,
             type=ARType.PROCEDURE,
             nesting_level=proc_symbol.scope_level + 1,
+            variables=proc_symbol.variables,
+            enclosing=enclosing,
         )
 
         formal_params = proc_symbol.formal_params
         actual_params = node.actual_params
 
         for param_symbol, argument_node in zip(formal_params, actual_params):
-            ar[param_symbol.name] = self.visit(argument_node)
+            ar.slots[param_symbol.slot] = self.visit(argument_node)
 
         self.call_stack.push(ar)
 
-        self.log(f'ENTER: PROCEDURE {proc_name}')
-        self.log(str(self.call_stack))
+        self.log('ENTER: PROCEDURE {}', proc_name)
+        self.log(self.call_stack)
 
         # evaluate procedure body
         self.visit(proc_symbol.block_ast)
 
-        self.log(f'LEAVE: PROCEDURE {proc_name}')
-        self.log(str(self.call_stack))
+        self.log('LEAVE: PROCEDURE {}', proc_name)
+        self.log(self.call_stack)
 
         self.call_stack.pop()
 
@@ -1212,6 +3307,256 @@ class Interpreter(NodeVisitor):
         return self.visit(tree)
 
 
+###############################################################################
+#                                                                             #
+#  AST CACHE                                                                  #
+#                                                                             #
+###############################################################################
+
+CACHE_DIR = '__spicache__'
+# the source file is read in chunks of this many bytes or characters
+_CACHE_CHUNK_SIZE = 1 << 20
+
+
+class _TreePickler(pickle.Pickler):
+    """Pickler that stores references to the LineIndex, not the index.
+
+    Tokens refer to the LineIndex of their source which holds the whole
+    source text; the unpickler links them to a fresh index instead.
+    """
+    def persistent_id(self, obj):
+        if isinstance(obj, LineIndex):
+            return 'lines'
+        return None
+
+
+class _TreeUnpickler(pickle.Unpickler):
+    def __init__(self, file, lines):
+        super().__init__(file)
+        self.lines = lines
+
+    def persistent_load(self, pid):
+        if pid == 'lines':
+            return self.lines
+        raise pickle.UnpicklingError(f'unsupported persistent id: {pid}')
+
+
+@contextlib.contextmanager
+def _gc_paused():
+    """Pause the cyclic garbage collector.
+
+    Building or walking a large tree would trigger collections that
+    scan all of its nodes again and again without finding garbage.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def dump_tree(tree, file):
+    """Serialize an AST (and the symbols it refers to) into a file."""
+    with _gc_paused():
+        _TreePickler(file, protocol=pickle.HIGHEST_PROTOCOL).dump(tree)
+
+
+def load_tree(file, lines):
+    """Read an AST written by dump_tree, its tokens linked to `lines`."""
+    with _gc_paused():
+        return _TreeUnpickler(file, lines).load()
+
+
+def _interpreter_digest(_digest=[]):
+    """Return a digest of this interpreter's source, its 'version'."""
+    if not _digest:
+        with open(__file__, 'rb') as f:
+            _digest.append(hashlib.sha256(f.read()).digest())
+    return _digest[0]
+
+
+def cache_key(path, analyzer_class=SemanticAnalyzer):
+    """Return the key of the cache entry of the source file: a digest
+    of its contents, read in chunks, of the class that analyzes it and
+    of the interpreter's version."""
+    digest = hashlib.sha256(_interpreter_digest())
+    digest.update(analyzer_class.__name__.encode('ascii') + b'\n')
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_CACHE_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest().encode('ascii')
+
+
+def _cache_path(path):
+    directory, name = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, CACHE_DIR, name + '.pickle')
+
+
+def _read_line_index(path):
+    """Return the LineIndex of the source file, read in chunks."""
+    lines = LineIndex()
+    offset = 0
+    with open(path, 'r') as f:
+        for chunk in iter(lambda: f.read(_CACHE_CHUNK_SIZE), ''):
+            index = chunk.find('\n')
+            while index != -1:
+                lines.add_line_start(offset + index + 1)
+                index = chunk.find('\n', index + 1)
+            offset += len(chunk)
+    return lines
+
+
+def load_cached_tree(path, key):
+    """Return the cached analyzed AST of the source file or None.
+
+    The cache entry is used only if it was written with the same key,
+    see cache_key. The source is read again only on a hit, to resolve
+    token positions.
+    """
+    try:
+        with open(_cache_path(path), 'rb') as f:
+            if f.readline().rstrip(b'\n') != key:
+                return None
+            return load_tree(f, _read_line_index(path))
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+
+def store_cached_tree(path, key, tree):
+    """Cache the analyzed AST of the source file under the key, see
+    load_cached_tree."""
+    cache_path = _cache_path(path)
+    tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(tmp_path, 'wb') as f:
+            f.write(key + b'\n')
+            dump_tree(tree, f)
+        # readers never see a partially written entry
+        os.replace(tmp_path, cache_path)
+    except (OSError, TypeError, pickle.PicklingError):
+        # like __pycache__, the cache is an optimization only
+        pass
+    finally:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp_path)
+
+
+###############################################################################
+#                                                                             #
+#  PARALLEL PARSING                                                           #
+#                                                                             #
+###############################################################################
+
+# the TokenBuffer of the program in a parse_parallel worker process
+_worker_buffer = None
+
+
+def _init_parse_worker(buffer):
+    global _worker_buffer
+    _worker_buffer = buffer
+
+
+def _parse_block(start):
+    """Worker of parse_parallel: parse the block that starts at token
+    `start` of the buffer.
+
+    Return the index of the token after the block and the FlatTree of
+    the Block serialized with tobytes(), or None if the block has a
+    syntax error.
+    """
+    parser = Parser(_worker_buffer.reader(start))
+    try:
+        with _gc_paused():
+            block = parser.block()
+    except ParserError:
+        return None
+    return parser.current_index(), flatten(block).tobytes()
+
+
+def parse_parallel(lexer, workers=None):
+    """Parse a program, the blocks of its top-level procedures in
+    worker processes.
+
+    LazyParser parses the program and finds the range of tokens of
+    every procedure block. The blocks are parsed by ProcessPoolExecutor
+    workers that get the TokenBuffer once, when they start, and send
+    each Block back as a FlatTree serialized with tobytes(). The views
+    of their roots are spliced into the tree in source order without
+    building node objects, so the result walks like the AST of
+    Parser.parse() with FlatNode views for the procedure blocks. On a
+    syntax error the program is parsed again sequentially to raise the
+    same ParserError.
+    """
+    parser = LazyParser(lexer)
+    buffer = parser.lexer.buffer
+    try:
+        tree = parser.parse()
+    except ParserError:
+        tree = None
+
+    if tree is not None:
+        proc_decls = [
+            node for node in tree.block.declarations
+            if isinstance(node, ProcedureDecl)
+        ]
+        starts = [proc_decl.block_node.start for proc_decl in proc_decls]
+        chunksize = max(1, len(starts) // (4 * (workers or os.cpu_count())))
+        results = []
+        if starts:
+            with concurrent.futures.ProcessPoolExecutor(
+                workers,
+                initializer=_init_parse_worker,
+                initargs=(buffer,),
+            ) as executor:
+                results = list(
+                    executor.map(_parse_block, starts, chunksize=chunksize)
+                )
+        for proc_decl, result in zip(proc_decls, results):
+            if result is None or result[0] != proc_decl.block_node.stop:
+                tree = None
+                break
+            block = FlatTree.frombuffer(result[1], buffer.lines).root()
+            proc_decl.block_node = block
+
+    if tree is None:
+        # raise the ParserError of the first syntax error
+        return Parser(buffer.reader()).parse()
+    return tree
+
+
+def _make_lexer(args):
+    """Create the token source selected by the command line options."""
+    if args.mmap:
+        with open(args.inputfile, 'rb') as f:
+            # the mapping stays valid after the file is closed
+            text = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return RegexLexer(text)
+    if args.stream:
+        return StreamLexer(open(args.inputfile, 'r'))
+
+    text = open(args.inputfile, 'r').read()
+    if args.lex_workers:
+        buffer = tokenize_parallel(text, workers=args.lex_workers)
+        return buffer.reader()
+    if args.lexer == 'regex':
+        return RegexLexer(text)
+    return Lexer(text)
+
+
+def _make_parser(args, lexer):
+    """Create the parser selected by the command line options."""
+    if args.parser == 'iterative':
+        return IterativeParser(lexer)
+    if args.parser == 'lazy':
+        return LazyParser(lexer)
+    if args.parser == 'hash-consing':
+        return HashConsingParser(lexer)
+    return Parser(lexer)
+
+
 def main():
     parser = argparse.ArgumentParser(
         description='SPI - Simple Pascal Interpreter'
@@ -1227,31 +3572,133 @@ def main():
         help='Print call stack',
         action='store_true',
     )
+    parser.add_argument(
+        '--lexer',
+        help='Lexer engine: character-by-character (default) or master regex',
+        choices=('char', 'regex'),
+        default='char',
+    )
+    parser.add_argument(
+        '--parser',
+        help='Parser engine: recursive descent (default), explicit stacks '
+             'for very deeply nested programs, lazy parsing of '
+             'procedure bodies on their first call, or recursive descent '
+             'that shares identical expressions (errors in a shared '
+             'expression are reported at its first occurrence)',
+        choices=('recursive', 'iterative', 'lazy', 'hash-consing'),
+        default='recursive',
+    )
+    parser.add_argument(
+        '--parse-workers',
+        help='Parse the top-level procedures in this many worker processes',
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        '--recover',
+        help='Report all syntax or semantic errors instead of only the '
+             'first one',
+        action='store_true',
+    )
+    parser.add_argument(
+        '--lex-workers',
+        help='Lex the source in this many worker processes',
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        '--stream',
+        help='Read the source file in chunks instead of all at once',
+        action='store_true',
+    )
+    parser.add_argument(
+        '--mmap',
+        help='Lex a memory-mapped ASCII source file (uses the regex lexer)',
+        action='store_true',
+    )
+    parser.add_argument(
+        '--typecheck',
+        help='Check the types of expressions and run typed operations',
+        action='store_true',
+    )
+    parser.add_argument(
+        '--flat',
+        help='Keep the AST in flat arrays instead of node objects',
+        action='store_true',
+    )
+    parser.add_argument(
+        '--cache',
+        help=f'Cache the analyzed AST in the {CACHE_DIR} directory',
+        action='store_true',
+    )
     args = parser.parse_args()
+    if args.stream and (args.parser == 'lazy' or args.parse_workers):
+        parser.error('the lazy and parallel parsers cannot read the source '
+                     'in chunks')
+    if args.parse_workers and (args.recover or args.parser != 'recursive'):
+        parser.error('the parallel parser uses the recursive descent parser '
+                     'and does not recover from errors')
+    if args.stream and args.mmap:
+        parser.error('the source cannot be both read in chunks and '
+                     'memory-mapped')
+    if args.lex_workers and (args.stream or args.mmap):
+        parser.error('the parallel lexer cannot read the source in chunks '
+                     'or memory-mapped')
 
     global _SHOULD_LOG_SCOPE, _SHOULD_LOG_STACK
     _SHOULD_LOG_SCOPE, _SHOULD_LOG_STACK = args.scope, args.stack
 
-    text = open(args.inputfile, 'r').read()
+    analyzer_class = TypeChecker if args.typecheck else SemanticAnalyzer
+    tree = None
+    if args.cache:
+        key = cache_key(args.inputfile, analyzer_class)
+        tree = load_cached_tree(args.inputfile, key)
+
+    if tree is None:
+        try:
+            lexer = _make_lexer(args)
+            if args.parse_workers:
+                tree = parse_parallel(lexer, workers=args.parse_workers)
+            elif args.recover:
+                tree, errors = _make_parser(args, lexer).parse_with_recovery()
+                for error in errors:
+                    print(error.message)
+                if errors:
+                    sys.exit(1)
+            else:
+                tree = _make_parser(args, lexer).parse()
+        except (LexerError, ParserError) as e:
+            print(e.message)
+            sys.exit(1)
+
+        if args.flat:
+            tree = flatten(tree).root()
+
+        semantic_analyzer = analyzer_class()
+        if args.recover:
+            errors = semantic_analyzer.analyze_with_recovery(tree)
+            for error in errors:
+                print(error.message)
+            if errors:
+                sys.exit(1)
+        else:
+            try:
+                semantic_analyzer.visit(tree)
+            except SemanticError as e:
+                print(e.message)
+                sys.exit(1)
 
-    lexer = Lexer(text)
-    try:
-        parser = Parser(lexer)
-        tree = parser.parse()
-    except (LexerError, ParserError) as e:
-        print(e.message)
-        sys.exit(1)
+        if args.cache:
+            store_cached_tree(args.inputfile, key, tree)
 
-    semantic_analyzer = SemanticAnalyzer()
+    interpreter = Interpreter(tree)
     try:
-        semantic_analyzer.visit(tree)
-    except SemanticError as e:
+        interpreter.interpret()
+    except (ParserError, SemanticError) as e:
+        # found in the block of a procedure, see LazyBlock
         print(e.message)
         sys.exit(1)
 
-    interpreter = Interpreter(tree)
-    interpreter.interpret()
-
 
 if __name__ == '__main__':
     main()
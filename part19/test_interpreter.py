@@ -39,6 +39,362 @@ class LexerTestCase(unittest.TestCase):
         with self.assertRaises(LexerError):
             lexer.get_next_token()
 
+    def test_lexer_exception_position(self):
+        from spi import LexerError
+        lexer = self.makeLexer('x :=\n  {}<')
+        lexer.get_next_token()
+        lexer.get_next_token()
+        with self.assertRaises(LexerError) as cm:
+            lexer.get_next_token()
+        self.assertIn('line: 2 column: 5', cm.exception.message)
+
+    def test_unterminated_comment(self):
+        from spi import LexerError, ErrorCode
+        lexer = self.makeLexer('x\n  {comment\n  y := 1')
+        lexer.get_next_token()
+        with self.assertRaises(LexerError) as cm:
+            lexer.get_next_token()
+        the_exception = cm.exception
+        self.assertEqual(
+            the_exception.error_code, ErrorCode.UNTERMINATED_COMMENT
+        )
+        self.assertIn('line: 2 column: 3', the_exception.message)
+
+
+class LineIndexTestCase(unittest.TestCase):
+    def test_position(self):
+        from spi import LineIndex
+        lines = LineIndex('ab\n\ncd\n')
+        self.assertEqual(
+            [lines.position(offset) for offset in range(7)],
+            [(1, 1), (1, 2), (1, 3), (2, 1), (3, 1), (3, 2), (3, 3)],
+        )
+
+    def test_incremental_position(self):
+        from spi import LineIndex
+        lines = LineIndex()
+        lines.add_line_start(3)
+        self.assertEqual(lines.position(1), (1, 2))
+        self.assertEqual(lines.position(4), (2, 2))
+
+    def test_forwarded_offsets(self):
+        from spi import LineIndex
+        text = 'a := b;\nc := d;\n'
+        first = lines = LineIndex(text)
+        # replace 'b' with 'bb + 1', then delete 'c := d;'
+        for offset, removed, inserted in ((5, 1, 'bb + 1'), (13, 7, '')):
+            text = text[:offset] + inserted + text[offset + removed:]
+            edited = LineIndex(text)
+            lines.forward(edited, offset + removed, len(inserted) - removed)
+            lines = edited
+        self.assertEqual(text, 'a := bb + 1;\n\n')
+        offsets = [0, 2, 6, 15]  # 'a', ':=', ';' and the last newline
+        current, resolved = first.resolve_many(offsets)
+        self.assertIs(current, lines)
+        self.assertEqual(resolved, [0, 2, 11, 13])
+        self.assertEqual(
+            [first.resolve(offset) for offset in offsets],
+            [(lines, offset) for offset in resolved],
+        )
+        self.assertEqual(first.position(6), (1, 12))
+
+
+class NameTableTestCase(unittest.TestCase):
+    text = 'alpha := beta + alpha; begin Beta := alpha end'
+
+    def assertInterned(self, tokens, names):
+        from spi import TokenType
+        alpha1, beta1, alpha2, keyword, beta2, alpha3 = (
+            tokens[0], tokens[2], tokens[4], tokens[6], tokens[7], tokens[9]
+        )
+        self.assertIs(alpha1.value, alpha2.value)
+        self.assertIs(alpha1.value, alpha3.value)
+        self.assertEqual(alpha1.name_id, alpha3.name_id)
+        self.assertNotEqual(beta1.name_id, beta2.name_id)
+        self.assertEqual(keyword.type, TokenType.BEGIN)
+        self.assertEqual(names.names, ['alpha', 'beta', 'Beta'])
+        self.assertEqual(names.names[beta2.name_id], 'Beta')
+
+    def test_lexers_intern_identifiers(self):
+        from spi import Lexer, RegexLexer
+        for lexer in (
+            Lexer(self.text),
+            RegexLexer(self.text),
+            RegexLexer(self.text.encode('ascii')),
+        ):
+            tokens = [lexer.get_next_token() for _ in range(11)]
+            self.assertInterned(tokens, lexer.names)
+
+    def test_token_buffer_interns_identifiers(self):
+        from spi import Lexer, RegexLexer
+        for lexer in (Lexer(self.text), RegexLexer(self.text)):
+            reader = lexer.tokenize().reader()
+            tokens = [reader.get_next_token() for _ in range(11)]
+            self.assertInterned(tokens, lexer.names)
+
+    def test_shared_name_table(self):
+        from spi import Lexer, NameTable
+        names = NameTable()
+        first = Lexer('x', names).get_next_token()
+        second = Lexer('y x', names)
+        second.get_next_token()
+        self.assertEqual(second.get_next_token().name_id, first.name_id)
+        self.assertEqual(len(names), 2)
+
+
+class RegexLexerTestCase(LexerTestCase):
+    def makeLexer(self, text):
+        from spi import RegexLexer
+        lexer = RegexLexer(text)
+        return lexer
+
+    def test_same_tokens_as_char_lexer(self):
+        from spi import Lexer, TokenType
+        text = """\
+PROGRAM Part19; { comment
+spanning lines }
+VAR x, y1 : INTEGER; z : REAL;
+begin
+   x := 3 + (y1 DIV 2) * 4;   z := 3.14 / 2. - x;
+   Alpha(x, -1)
+END.
+"""
+        char_lexer = Lexer(text)
+        regex_lexer = self.makeLexer(text)
+        while True:
+            expected = char_lexer.get_next_token()
+            token = regex_lexer.get_next_token()
+            self.assertEqual(
+                (token.type, token.value, token.lineno, token.column),
+                (expected.type, expected.value, expected.lineno, expected.column),
+            )
+            if expected.type == TokenType.EOF:
+                break
+
+
+class BytesRegexLexerTestCase(RegexLexerTestCase):
+    def makeLexer(self, text):
+        from spi import RegexLexer
+        lexer = RegexLexer(text.encode('ascii'))
+        return lexer
+
+    def test_non_ascii_input(self):
+        from spi import RegexLexer, LexerError
+        lexer = RegexLexer('x := \u00e9'.encode('utf-8'))
+        lexer.get_next_token()
+        lexer.get_next_token()
+        with self.assertRaises(LexerError):
+            lexer.get_next_token()
+
+
+class StreamLexerTestCase(RegexLexerTestCase):
+    def makeLexer(self, text, chunk_size=3):
+        import io
+        from spi import StreamLexer
+        lexer = StreamLexer(io.StringIO(text), chunk_size=chunk_size)
+        return lexer
+
+    def test_lexemes_across_chunk_boundaries(self):
+        import io
+        from spi import Lexer, StreamLexer, TokenType
+        text = 'BEGIN {a long comment}\n  number12 := 3.14; x:=2 END.'
+        for stream in (io.StringIO, io.BytesIO):
+            for chunk_size in range(1, len(text) + 1):
+                source = text if stream is io.StringIO else text.encode()
+                lexer = StreamLexer(stream(source), chunk_size=chunk_size)
+                char_lexer = Lexer(text)
+                while True:
+                    expected = char_lexer.get_next_token()
+                    token = lexer.get_next_token()
+                    self.assertEqual(
+                        (token.type, token.value, token.lineno, token.column),
+                        (expected.type, expected.value,
+                         expected.lineno, expected.column),
+                    )
+                    if expected.type == TokenType.EOF:
+                        break
+
+
+class TokenBufferTestCase(unittest.TestCase):
+    text = """\
+PROGRAM Part19; { comment
+spanning lines }
+VAR x, y1 : INTEGER; z : REAL;
+begin
+   y1 := 1;
+   x := 3 + (y1 DIV 2) * 4;   z := 3.14 / 2. - x;
+END.
+"""
+
+    def assertSameTokens(self, reader, lexer):
+        from spi import TokenType
+        while True:
+            expected = lexer.get_next_token()
+            token = reader.get_next_token()
+            self.assertEqual(
+                (token.type, token.value, token.lineno, token.column),
+                (expected.type, expected.value, expected.lineno, expected.column),
+            )
+            if expected.type == TokenType.EOF:
+                break
+
+    def test_tokenize(self):
+        from spi import Lexer, RegexLexer
+        for lexer_class in (Lexer, RegexLexer):
+            buffer = lexer_class(self.text).tokenize()
+            self.assertEqual(len(buffer), 41)
+            reader = buffer.reader(flyweights=False)
+            self.assertSameTokens(reader, Lexer(self.text))
+
+    def test_tokenize_mmap(self):
+        import mmap
+        import tempfile
+        from spi import Lexer, RegexLexer
+        with tempfile.TemporaryFile() as f:
+            f.write(self.text.encode('ascii'))
+            f.flush()
+            text = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            buffer = RegexLexer(text).tokenize()
+            reader = buffer.reader(flyweights=False)
+            self.assertSameTokens(reader, Lexer(self.text))
+            text.close()
+
+    def test_tokenize_stream(self):
+        import io
+        from spi import Lexer, StreamLexer
+        lexer = StreamLexer(io.StringIO(self.text), chunk_size=5)
+        buffer = lexer.tokenize()
+        self.assertEqual(len(buffer), 41)
+        reader = buffer.reader(flyweights=False)
+        self.assertSameTokens(reader, Lexer(self.text))
+
+    def test_slice(self):
+        from spi import RegexLexer
+        buffer = RegexLexer(self.text).tokenize()
+        reader = buffer.slice(4, 7).reader()
+        self.assertEqual(
+            [reader.get_next_token().value for _ in range(4)],
+            ['x', ',', 'y1', None],
+        )
+
+    def test_flyweight_tokens(self):
+        from spi import RegexLexer, TokenType
+        reader = RegexLexer('x := x; y := y;').tokenize().reader()
+        tokens = [reader.get_next_token() for _ in range(8)]
+        self.assertIs(tokens[1], tokens[5])  # ':='
+        self.assertIs(tokens[3], tokens[7])  # ';'
+        self.assertIsNot(tokens[0], tokens[2])
+        self.assertEqual(tokens[3].type, TokenType.SEMI)
+        self.assertEqual(tokens[3].lineno, None)
+        self.assertEqual(tokens[4].lineno, 1)
+
+    def test_parser_error_position_with_flyweights(self):
+        from spi import RegexLexer, Parser, ParserError, ErrorCode
+        buffer = RegexLexer(
+            """
+            PROGRAM Test;
+            VAR
+                a : INTEGER;
+            BEGIN
+               a := 10 * ;  {Invalid syntax}
+            END.
+            """
+        ).tokenize()
+        with self.assertRaises(ParserError) as cm:
+            Parser(buffer.reader()).parse()
+        the_exception = cm.exception
+        self.assertEqual(the_exception.error_code, ErrorCode.UNEXPECTED_TOKEN)
+        self.assertEqual(the_exception.token.value, ';')
+        self.assertEqual(the_exception.token.lineno, 6)
+        self.assertEqual(the_exception.token.column, 26)
+
+    def test_parser_error_position_after_peek(self):
+        from spi import RegexLexer, Parser, ParserError, ErrorCode
+        parser = Parser(RegexLexer('\n  ; x := 1').tokenize().reader())
+        self.assertEqual(parser.peek(3).value, 1)
+        self.assertEqual(parser.peek(10).type.value, 'EOF')
+        with self.assertRaises(ParserError) as cm:
+            parser.error(ErrorCode.UNEXPECTED_TOKEN, parser.current_token)
+        self.assertEqual(cm.exception.token.value, ';')
+        self.assertEqual(cm.exception.token.position(), (2, 3))
+
+    def test_parse_from_buffer(self):
+        from spi import RegexLexer, Parser, SemanticAnalyzer, Interpreter
+        buffer = RegexLexer(self.text).tokenize()
+        tree = Parser(buffer.reader()).parse()
+        SemanticAnalyzer().visit(tree)
+        interpreter = Interpreter(tree)
+        interpreter.call_stack = TestCallStack()
+        interpreter.interpret()
+        ar = interpreter.call_stack.peek()
+        self.assertEqual(ar['x'], 3)
+        self.assertAlmostEqual(ar['z'], 3.14 / 2. - 3)
+
+
+class ParallelLexingTestCase(unittest.TestCase):
+    text = """\
+PROGRAM Parallel; { a comment with spaces
+and a few lines }
+VAR
+   number, a1 : INTEGER;
+   y          : REAL;
+BEGIN {Parallel}
+   number := 2;   {another   comment}
+   a1 := number * 10 DIV 4;
+   y := 20 / 7 + 3.14
+END.  {Parallel}
+"""
+
+    def test_split_points(self):
+        from spi import _find_split_points
+        for chunk_size in range(1, 60):
+            points = _find_split_points(self.text, chunk_size)
+            self.assertTrue(points)
+            for point in points:
+                self.assertTrue(self.text[point].isspace())
+                # not inside a comment
+                self.assertGreaterEqual(
+                    self.text.rfind('}', 0, point),
+                    self.text.rfind('{', 0, point),
+                )
+
+    def test_same_buffer_as_single_process(self):
+        from spi import RegexLexer, tokenize_parallel
+        expected = RegexLexer(self.text).tokenize()
+        buffer = tokenize_parallel(self.text, workers=2, chunk_size=40)
+        for name in ('types', 'starts', 'lengths', 'values', 'literals'):
+            self.assertEqual(getattr(buffer, name), getattr(expected, name))
+        self.assertEqual(buffer.names.names, expected.names.names)
+
+    def test_lexer_error_position(self):
+        from spi import LexerError, tokenize_parallel
+        text = self.text.replace('3.14', '3.14 <')
+        with self.assertRaises(LexerError) as cm:
+            tokenize_parallel(text, workers=2, chunk_size=40)
+        self.assertIn('line: 9 column: 23', cm.exception.message)
+
+
+def dump_ast(node):
+    """Nested tuples with the structure and the tokens of an AST."""
+    import spi
+    from spi import AST, FlatNode, Token
+    if isinstance(node, (AST, FlatNode)):
+        # a FlatNode view has the fields of the AST class of its name
+        node_class = getattr(spi, type(node).__name__)
+        names = sorted(
+            name
+            for cls in node_class.__mro__
+            for name in getattr(cls, '__slots__', ())
+        )
+        return (type(node).__name__,) + tuple(
+            (name, dump_ast(getattr(node, name))) for name in names
+        )
+    if isinstance(node, list):
+        return tuple(dump_ast(item) for item in node)
+    if isinstance(node, Token):
+        return node.type, node.value, node.position()
+    return node
+
 
 class ParserTestCase(unittest.TestCase):
     def makeParser(self, text):
@@ -129,13 +485,330 @@ class ParserTestCase(unittest.TestCase):
         self.assertEqual(the_exception.token.value, 'VAR')
         self.assertEqual(the_exception.token.lineno, 5)  # second VAR
 
+    def test_peek(self):
+        from spi import TokenType
+        parser = self.makeParser('PROGRAM Test; BEGIN END.')
+        self.assertEqual(parser.peek().value, 'Test')
+        self.assertEqual(parser.peek(3).type, TokenType.BEGIN)
+        self.assertEqual(parser.peek(5).type, TokenType.DOT)
+        self.assertEqual(parser.peek(6).type, TokenType.EOF)
+        self.assertEqual(parser.peek(100).type, TokenType.EOF)
+        parser.eat(TokenType.PROGRAM)
+        self.assertEqual(parser.current_token.value, 'Test')
+        self.assertEqual(parser.peek().type, TokenType.SEMI)
+
+    def test_procedure_call_with_space_before_lparen(self):
+        from spi import ProcedureCall
+        parser = self.makeParser(
+            """
+            PROGRAM Test;
+            PROCEDURE Alpha(a : INTEGER);
+            BEGIN END;
+            BEGIN
+               Alpha (1);
+               Alpha
+                  (2)
+            END.
+            """
+        )
+        statements = parser.parse().block.compound_statement.children
+        self.assertIsInstance(statements[0], ProcedureCall)
+        self.assertIsInstance(statements[1], ProcedureCall)
+
+    def test_parse_with_recovery(self):
+        from spi import ErrorCode, ProcedureDecl, VarDecl
+        parser = self.makeParser(
+            """
+            PROGRAM Test;
+            VAR
+               a : INTEGER;
+               b   INTEGER;
+               c : REAL;
+
+            PROCEDURE P1(x : INTEGER);
+            BEGIN
+               a := x * ;
+               c := 1.5
+            END;
+
+            PROCEDURE P2(y : INTEGER) INTEGER;
+            BEGIN
+            END;
+
+            BEGIN
+               a := 2;
+               b := (a + 1;
+               BEGIN
+                  c := a / 2 3;
+               END;
+               P1(a)
+            END.
+            """
+        )
+        tree, errors = parser.parse_with_recovery()
+        self.assertEqual(
+            [(e.token.value, e.token.lineno) for e in errors],
+            [('INTEGER', 5), (';', 10), ('INTEGER', 14), (';', 20), (3, 22)],
+        )
+        for error in errors:
+            self.assertEqual(error.error_code, ErrorCode.UNEXPECTED_TOKEN)
+
+        declarations = tree.block.declarations
+        self.assertEqual(
+            [d.var_node.value for d in declarations if isinstance(d, VarDecl)],
+            ['a', 'c'],
+        )
+        self.assertEqual(
+            [d.proc_name for d in declarations
+             if isinstance(d, ProcedureDecl)],
+            ['P1'],
+        )
+        statements = tree.block.compound_statement.children
+        self.assertEqual(
+            [type(node).__name__ for node in statements],
+            ['Assign', 'NoOp', 'Compound', 'ProcedureCall'],
+        )
+
+    def test_parse_with_recovery_without_errors(self):
+        parser = self.makeParser('PROGRAM Test; BEGIN a := 1 END.')
+        tree, errors = parser.parse_with_recovery()
+        self.assertEqual(errors, [])
+        self.assertEqual(tree.name, 'Test')
+
+    def test_parse_with_recovery_unrecoverable(self):
+        parser = self.makeParser('PROGRAM Test BEGIN a := 1 END.')
+        tree, errors = parser.parse_with_recovery()
+        self.assertIsNone(tree)
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(errors[0].token.value, 'BEGIN')
+
+    def test_expression_grouping(self):
+        from spi import BinOp, UnaryOp
+
+        def render(node):
+            if isinstance(node, BinOp):
+                return f'({render(node.left)} {node.op.value} {render(node.right)})'
+            if isinstance(node, UnaryOp):
+                return f'({node.op.value}{render(node.expr)})'
+            return str(node.value)
+
+        for expr, grouping in (
+            ('a - b + c', '((a - b) + c)'),
+            ('a + b * c', '(a + (b * c))'),
+            ('a * b DIV c / d', '(((a * b) DIV c) / d)'),
+            ('a - b * c + d', '((a - (b * c)) + d)'),
+            ('-a * +b', '((-a) * (+b))'),
+            ('- (a + b) * c', '((-(a + b)) * c)'),
+            ('2 * (3 - 4.5)', '(2 * (3 - 4.5))'),
+        ):
+            parser = self.makeParser(
+                'PROGRAM Test; BEGIN x := %s END.' % expr
+            )
+            assign = parser.parse().block.compound_statement.children[0]
+            self.assertEqual(render(assign.right), grouping, expr)
+
+    def test_ast_nodes_have_no_instance_dict(self):
+        from spi import AST
+        parser = self.makeParser(
+            'PROGRAM Test; VAR x : INTEGER; BEGIN x := -(1 + 2) END.'
+        )
+        nodes = [parser.parse()]
+        while nodes:
+            node = nodes.pop()
+            self.assertFalse(hasattr(node, '__dict__'), type(node).__name__)
+            for cls in type(node).__mro__:
+                for name in getattr(cls, '__slots__', ()):
+                    value = getattr(node, name)
+                    values = value if isinstance(value, list) else [value]
+                    nodes.extend(v for v in values if isinstance(v, AST))
+
+
+class IterativeParserTestCase(ParserTestCase):
+    def makeParser(self, text):
+        from spi import Lexer, IterativeParser
+        lexer = Lexer(text)
+        parser = IterativeParser(lexer)
+        return parser
+
+    def test_same_tree_as_recursive_parser(self):
+        from spi import Lexer, Parser
+        text = """
+        PROGRAM Test;
+        VAR
+           x, y : INTEGER;
+           z    : REAL;
+
+        PROCEDURE P1(a : INTEGER; b : REAL);
+        VAR k : INTEGER;
+
+           PROCEDURE P2;
+           BEGIN {P2}
+              k := -(a + - - 2) * (3 DIV (k - 1));
+           END;  {P2}
+
+        BEGIN {P1}
+           BEGIN BEGIN P2(); END; ; END;
+           k := a - b / 2.5 + a * b;
+        END;  {P1}
+
+        PROCEDURE P3;
+        BEGIN END;
+
+        BEGIN {Test}
+           x := 1; y := +x - 1;
+           BEGIN z := x / (y + 1) END;
+           P1(x + y, z * 2)
+        END.  {Test}
+        """
+        expected = Parser(Lexer(text)).parse()
+        tree = self.makeParser(text).parse()
+        self.assertEqual(dump_ast(tree), dump_ast(expected))
+
+    def test_same_errors_as_recursive_parser(self):
+        from spi import Lexer, Parser
+        texts = [
+            'program p; procedure q; x; begin end; begin a := 1 b end.',
+            'program p; procedure q; var v : integer; '
+            'procedure r(; begin v := end; begin end; begin end.',
+            'program p; procedure q; procedure r; begin end '
+            'begin x := 1 end; begin end.',
+        ]
+        for text in texts:
+            expected_tree, expected = Parser(Lexer(text)).parse_with_recovery()
+            tree, errors = self.makeParser(text).parse_with_recovery()
+            self.assertEqual(
+                [(error.token.type, error.token.pos) for error in errors],
+                [(error.token.type, error.token.pos) for error in expected],
+            )
+            self.assertEqual(dump_ast(tree), dump_ast(expected_tree))
+
+    def test_deep_nesting(self):
+        depth = 10000
+        text = (
+            'PROGRAM Test;' +
+            'PROCEDURE P; ' * depth +
+            'BEGIN END; ' * depth +
+            'BEGIN ' * depth +
+            'x := ' + '-(' * depth + '1' + ')' * depth +
+            ' END' * depth +
+            '.'
+        )
+        block = self.makeParser(text).parse().block
+        for _ in range(depth):
+            block = block.declarations[0].block_node
+        self.assertEqual(block.declarations, [])
+
+        node = self.makeParser(text).parse().block.compound_statement
+        for _ in range(depth - 1):
+            node = node.children[0]
+        node = node.children[0].right
+        for _ in range(depth):
+            self.assertEqual(node.op.value, '-')
+            node = node.expr
+        self.assertEqual(node.value, 1)
+
+
+class HashConsingParserTestCase(ParserTestCase):
+    def makeParser(self, text):
+        from spi import Lexer, HashConsingParser
+        lexer = Lexer(text)
+        parser = HashConsingParser(lexer)
+        return parser
+
+    text = """
+    PROGRAM Test;
+    VAR a, b : INTEGER;
+
+    PROCEDURE P;
+    VAR a : INTEGER;
+    BEGIN
+       a := (a + 1) * 2
+    END;
+
+    BEGIN
+       a := (a + 1) * 2 - (a + 1) DIV 2.0;
+       b := (a + 1) * 2
+    END.
+    """
+
+    def test_identical_expressions_are_shared(self):
+        tree = self.makeParser(self.text).parse()
+        first, second = tree.block.compound_statement.children
+        product = first.right.left
+        self.assertIs(second.right, product)
+        self.assertIs(first.right.right.left, product.left)
+        # the targets of assignments are not expressions
+        self.assertIsNot(first.left, product.left.left)
+
+    def test_integer_and_real_literals_are_not_shared(self):
+        tree = self.makeParser(self.text).parse()
+        first = tree.block.compound_statement.children[0]
+        two, two_real = first.right.left.right, first.right.right.right
+        self.assertEqual(two.value, two_real.value)
+        self.assertIsNot(two, two_real)
+
+    def test_expressions_are_shared_within_a_block(self):
+        tree = self.makeParser(self.text).parse()
+        proc_decl = tree.block.declarations[-1]
+        inner = proc_decl.block_node.compound_statement.children[0]
+        outer = tree.block.compound_statement.children[1]
+        self.assertIsNot(inner.right, outer.right)
+
+    def test_leaves_are_not_shared(self):
+        tree = self.makeParser(
+            'PROGRAM Test; BEGIN a := b; a := b + 1; a := 1 END.'
+        ).parse()
+        first, second, third = tree.block.compound_statement.children
+        self.assertIsNot(second.right.left, first.right)
+        self.assertEqual(second.right.left.token.position(), (1, 34))
+        self.assertIsNot(third.right, second.right.right)
+
+    def test_errors_at_each_occurrence(self):
+        from spi import ErrorCode, TypeChecker
+        tree = self.makeParser("""\
+PROGRAM Test;
+VAR x, w : INTEGER; z : REAL;
+PROCEDURE P(a : INTEGER);
+BEGIN END;
+BEGIN
+   x := z;
+   P(z);
+   w := x DIV z;
+   w := (x + z) DIV 2;
+   w := (x + z) DIV 2
+END.
+""").parse()
+        errors = TypeChecker().analyze_with_recovery(tree)
+        self.assertEqual(
+            [(error.error_code, error.token.position()) for error in errors],
+            [
+                (ErrorCode.TYPE_MISMATCH, (6, 9)),
+                (ErrorCode.TYPE_MISMATCH, (7, 6)),
+                (ErrorCode.TYPE_MISMATCH, (8, 15)),
+                # (x + z) DIV 2 is shared, its error is reported once
+                (ErrorCode.TYPE_MISMATCH, (9, 10)),
+            ],
+        )
+
+    def test_flatten_keeps_shared_nodes(self):
+        from spi import Lexer, Parser, flatten
+        flat = flatten(self.makeParser(self.text).parse())
+        tree = flatten(Parser(Lexer(self.text)).parse())
+        self.assertLess(len(flat), len(tree))
+        first, second = flat.root().block.compound_statement.children
+        self.assertEqual(first.right.left, second.right)
+
 
 class SemanticAnalyzerTestCase(unittest.TestCase):
-    def runSemanticAnalyzer(self, text):
-        from spi import Lexer, Parser, SemanticAnalyzer
+    def makeTree(self, text):
+        from spi import Lexer, Parser
         lexer = Lexer(text)
         parser = Parser(lexer)
-        tree = parser.parse()
+        return parser.parse()
+
+    def runSemanticAnalyzer(self, text):
+        from spi import SemanticAnalyzer
+        tree = self.makeTree(text)
 
         semantic_analyzer = SemanticAnalyzer()
         semantic_analyzer.visit(tree)
@@ -177,6 +850,370 @@ class SemanticAnalyzerTestCase(unittest.TestCase):
         self.assertEqual(the_exception.error_code, ErrorCode.ID_NOT_FOUND)
         self.assertEqual(the_exception.token.value, 'b')
 
+    def test_semantic_not_a_variable_error(self):
+        from spi import SemanticError, ErrorCode
+        with self.assertRaises(SemanticError) as cm:
+            self.runSemanticAnalyzer(
+            """
+            PROGRAM Test;
+            VAR
+                x : INTEGER;
+            PROCEDURE Foo;
+            BEGIN
+            END;
+            BEGIN
+               x := Foo
+            END.
+            """
+            )
+        the_exception = cm.exception
+        self.assertEqual(the_exception.error_code, ErrorCode.NOT_A_VARIABLE)
+        self.assertEqual(the_exception.token.value, 'Foo')
+
+    def test_analyze_with_recovery(self):
+        from spi import ErrorCode, SemanticAnalyzer
+        tree = self.makeTree(
+        """
+        PROGRAM Test;
+        VAR
+            a, b : INTEGER;
+            a : REAL;  {Duplicate identifier}
+
+        PROCEDURE P(c : INTEGER);
+        BEGIN
+           d := c + d * e;
+           b := -d
+        END;
+
+        BEGIN
+           f := a + b;
+           f := f + 1;
+           b := P + b;
+           P := b
+        END.
+        """
+        )
+        errors = SemanticAnalyzer().analyze_with_recovery(tree)
+        self.assertEqual(
+            [
+                (error.error_code, error.token.value, error.token.position())
+                for error in errors
+            ],
+            [
+                (ErrorCode.DUPLICATE_ID, 'a', (5, 13)),
+                (ErrorCode.ID_NOT_FOUND, 'd', (9, 21)),
+                (ErrorCode.ID_NOT_FOUND, 'e', (9, 25)),
+                (ErrorCode.ID_NOT_FOUND, 'f', (14, 12)),
+                (ErrorCode.NOT_A_VARIABLE, 'P', (16, 17)),
+                (ErrorCode.NOT_A_VARIABLE, 'P', (17, 12)),
+            ],
+        )
+
+    def test_analyze_with_recovery_without_errors(self):
+        from spi import SemanticAnalyzer
+        tree = self.makeTree(
+            'PROGRAM Test; VAR a : INTEGER; BEGIN a := -a END.'
+        )
+        self.assertEqual(SemanticAnalyzer().analyze_with_recovery(tree), [])
+
+
+class FlatSemanticAnalyzerTestCase(SemanticAnalyzerTestCase):
+    def makeTree(self, text):
+        from spi import Lexer, Parser, flatten
+        lexer = Lexer(text)
+        parser = Parser(lexer)
+        return flatten(parser.parse()).root()
+
+
+class TypeCheckerTestCase(unittest.TestCase):
+    def makeTree(self, text):
+        from spi import Lexer, Parser
+        return Parser(Lexer(text)).parse()
+
+    def checkTypes(self, text):
+        """Return the tree of the program and its semantic errors."""
+        from spi import TypeChecker
+        tree = self.makeTree(text)
+        errors = TypeChecker().analyze_with_recovery(tree)
+        return tree, [
+            (error.error_code, error.token.value, error.token.position())
+            for error in errors
+        ]
+
+    def test_expression_types(self):
+        tree, errors = self.checkTypes("""\
+PROGRAM Test;
+VAR i : INTEGER; r : REAL;
+BEGIN
+   i := -i * 2 + 7 DIV i;
+   r := i / 2 - r;
+   r := i + 1.5
+END.
+""")
+        self.assertEqual(errors, [])
+        first, second, third = tree.block.compound_statement.children
+        self.assertEqual(first.right.eval_type, 'INTEGER')
+        self.assertEqual(first.right.left.eval_type, 'INTEGER')
+        self.assertEqual(first.right.left.left.eval_type, 'INTEGER')
+        self.assertEqual(first.right.right.eval_type, 'INTEGER')
+        self.assertEqual(second.right.left.eval_type, 'REAL')
+        self.assertEqual(second.right.left.left.eval_type, 'INTEGER')
+        self.assertEqual(second.right.right.eval_type, 'REAL')
+        self.assertEqual(third.right.eval_type, 'REAL')
+        self.assertEqual(third.right.right.eval_type, 'REAL')
+
+    def test_type_mismatch(self):
+        from spi import ErrorCode, SemanticError, TypeChecker
+        text = """\
+PROGRAM Test;
+VAR i : INTEGER; r : REAL;
+PROCEDURE P(a : INTEGER; b : REAL);
+BEGIN END;
+BEGIN
+   r := i;
+   i := r * 2;
+   i := 7 / 2;
+   i := 3 DIV r;
+   P(r, i)
+END.
+"""
+        _, errors = self.checkTypes(text)
+        mismatch = ErrorCode.TYPE_MISMATCH
+        self.assertEqual(errors, [
+            (mismatch, 'r', (7, 9)),
+            (mismatch, 7, (8, 9)),
+            (mismatch, 'r', (9, 15)),
+            (mismatch, 'r', (10, 6)),
+        ])
+        with self.assertRaises(SemanticError) as cm:
+            TypeChecker().visit(self.makeTree(text))
+        self.assertEqual(cm.exception.error_code, mismatch)
+        self.assertEqual(cm.exception.token.position(), (7, 9))
+
+    def test_call_of_a_variable(self):
+        from spi import ErrorCode
+        _, errors = self.checkTypes("""\
+PROGRAM Test;
+VAR x : INTEGER; r : REAL;
+BEGIN
+   x(1);
+   Q(r);
+   x := r
+END.
+""")
+        self.assertEqual(errors, [
+            (ErrorCode.NOT_A_PROCEDURE, 'x', (4, 4)),
+            (ErrorCode.ID_NOT_FOUND, 'Q', (5, 4)),
+            (ErrorCode.TYPE_MISMATCH, 'r', (6, 9)),
+        ])
+
+    def test_no_mismatch_for_undeclared_names(self):
+        from spi import ErrorCode
+        _, errors = self.checkTypes("""\
+PROGRAM Test;
+VAR i : INTEGER;
+BEGIN
+   i := -(q + 1) DIV q;
+   i := 2 * q
+END.
+""")
+        self.assertEqual(errors, [(ErrorCode.ID_NOT_FOUND, 'q', (4, 11))])
+
+
+class FlatTypeCheckerTestCase(TypeCheckerTestCase):
+    def makeTree(self, text):
+        from spi import Lexer, Parser, flatten
+        return flatten(Parser(Lexer(text)).parse()).root()
+
+
+class ScopedSymbolTableTestCase(unittest.TestCase):
+    def makeScopes(self, depth):
+        """Return the innermost of `depth` nested scopes."""
+        from spi import ScopedSymbolTable
+        scope = ScopedSymbolTable('global', 1)
+        scope._init_builtins()
+        for level in range(2, depth + 1):
+            scope = ScopedSymbolTable(f'P{level}', level, scope)
+        return scope
+
+    def test_lookup_in_enclosing_scopes(self):
+        from spi import VarSymbol
+        scope = self.makeScopes(25)
+        integer = scope.lookup('INTEGER')
+        self.assertEqual(integer.name, 'INTEGER')
+        self.assertIs(scope.lookup('INTEGER'), integer)
+        self.assertIs(scope.enclosing_scope.lookup('INTEGER'), integer)
+        self.assertIsNone(scope.lookup('x'))
+        self.assertIsNone(scope.lookup('INTEGER', current_scope_only=True))
+
+        x = VarSymbol('x', integer)
+        scope.enclosing_scope.insert(x)
+        self.assertIs(scope.lookup('x'), x)
+
+    def test_insert_shadows_resolved_name(self):
+        from spi import VarSymbol
+        scope = self.makeScopes(5)
+        outermost = scope
+        while outermost.enclosing_scope is not None:
+            outermost = outermost.enclosing_scope
+        integer = scope.lookup('INTEGER')
+        outer_x = VarSymbol('x', integer)
+        outermost.insert(outer_x)
+        self.assertIs(scope.lookup('x'), outer_x)
+        self.assertIs(scope.enclosing_scope.lookup('x'), outer_x)
+
+        inner_x = VarSymbol('x', integer)
+        scope.enclosing_scope.insert(inner_x)
+        self.assertIs(scope.lookup('x'), inner_x)
+        self.assertIs(scope.enclosing_scope.lookup('x'), inner_x)
+        self.assertIs(outermost.lookup('x'), outer_x)
+
+
+class ParallelParsingTestCase(unittest.TestCase):
+    text = """\
+PROGRAM Parallel;
+VAR x : INTEGER;
+
+PROCEDURE P1(a : INTEGER; b : REAL);
+VAR k : INTEGER;
+   PROCEDURE P2;
+   BEGIN k := -(a + 2) * (3 DIV k) END;
+BEGIN
+   BEGIN P2() END;
+   k := a - b / 2.5
+END;
+
+PROCEDURE P3;
+BEGIN END;
+
+PROCEDURE P4(c : INTEGER);
+BEGIN c := c + 1; P3() END;
+
+BEGIN {Parallel}
+   x := 1;
+   P1(x, 2.5); P4(x)
+END.  {Parallel}
+"""
+
+    def test_same_tree_as_parser(self):
+        from spi import FlatNode, RegexLexer, Parser, flatten, parse_parallel
+        buffer = RegexLexer(self.text).tokenize()
+        expected = Parser(buffer.reader()).parse()
+        tree = parse_parallel(buffer.reader(), workers=2)
+        self.assertEqual(dump_ast(tree), dump_ast(expected))
+        p1 = tree.block.declarations[1]
+        self.assertIsInstance(p1.block_node, FlatNode)
+        self.assertIs(p1.block_node.declarations[0].var_node.token.lines,
+                      buffer.lines)
+        self.assertEqual(
+            dump_ast(flatten(tree).root()), dump_ast(flatten(expected).root())
+        )
+
+    def test_parser_error(self):
+        from spi import Lexer, ParserError, parse_parallel
+        for old, new, position in (
+            ('(3 DIV k)', '(3 DIV k', (7, 35)),   # in a procedure block
+            ('P3;', 'P3', (14, 1)),               # in a procedure heading
+            ('BEGIN END;', 'BEGIN', (16, 1)),     # unbalanced block
+        ):
+            with self.assertRaises(ParserError) as cm:
+                parse_parallel(Lexer(self.text.replace(old, new)), workers=2)
+            self.assertEqual(cm.exception.token.position(), position)
+
+
+class IncrementalParserTestCase(unittest.TestCase):
+    text = """\
+PROGRAM Incremental;
+VAR x : INTEGER;
+
+PROCEDURE P1(a : INTEGER);
+BEGIN a := a + 1 END;
+
+PROCEDURE P2(b : INTEGER);
+VAR k : INTEGER;
+BEGIN
+   k := b * 2;
+   BEGIN k := k - 1 END
+END;
+
+PROCEDURE P3;
+BEGIN END;
+
+BEGIN {Incremental}
+   x := 1;
+   P1(x); P2(x)
+END.  {Incremental}
+"""
+
+    def assertSameAsFullParse(self, parser, tree):
+        from spi import Parser, RegexLexer
+        expected = Parser(RegexLexer(parser.text)).parse()
+        self.assertEqual(dump_ast(tree), dump_ast(expected))
+
+    def test_edit_reuses_unchanged_subtrees(self):
+        from spi import IncrementalParser
+        parser = IncrementalParser(self.text)
+        tree = parser.parse()
+        p1, p2, p3 = tree.block.declarations[1:]
+        inner = p2.block_node.compound_statement.children[1]
+        main = tree.block.compound_statement
+
+        offset = self.text.index('k := b * 2') + len('k := ')
+        tree = parser.edit(offset, 1, '(x + b)\n\n')
+        self.assertSameAsFullParse(parser, tree)
+        self.assertEqual(tree.block.declarations[1:], [p1, p2, p3])
+        self.assertIs(tree.block.compound_statement, main)
+        compound = p2.block_node.compound_statement
+        self.assertIsNot(compound.children[1], inner)
+        self.assertEqual(compound.children[0].right.left.left.value, 'x')
+
+        # the tokens after the edit moved two lines down
+        call = main.children[1]
+        self.assertEqual(call.token.position(), (21, 4))
+
+        offset = parser.text.index('k - 1') + len('k ')
+        tree = parser.edit(offset, 1, '+')
+        self.assertSameAsFullParse(parser, tree)
+        self.assertIs(p2.block_node.compound_statement, compound)
+        self.assertEqual(compound.children[1].children[0].right.op.value, '+')
+        self.assertEqual(call.token.position(), (21, 4))
+
+    def test_edit_outside_procedures(self):
+        from spi import IncrementalParser
+        parser = IncrementalParser(self.text)
+        parser.parse()
+        offset = self.text.index('x : INTEGER')
+        tree = parser.edit(offset, 1, 'y, x')
+        self.assertSameAsFullParse(parser, tree)
+
+    def test_tokens_move_to_the_current_line_index(self):
+        import gc
+        import weakref
+        from spi import IncrementalParser
+        parser = IncrementalParser(self.text)
+        tree = parser.parse()
+        call = tree.block.compound_statement.children[1]
+        first_lines = weakref.ref(call.token.lines)
+
+        offset = self.text.index('k - 1') + len('k ')
+        for op in '+-' * parser.rebase_interval:
+            tree = parser.edit(offset, 1, op)
+            self.assertEqual(call.token.position(), (19, 4))
+        self.assertSameAsFullParse(parser, tree)
+        self.assertIs(call.token.lines, parser.lines)
+        gc.collect()
+        self.assertIsNone(first_lines())
+
+    def test_invalid_edit(self):
+        from spi import IncrementalParser, ParserError
+        parser = IncrementalParser(self.text)
+        parser.parse()
+        offset = self.text.index('a + 1') + len('a ')
+        with self.assertRaises(ParserError):
+            parser.edit(offset, 1, '* *')
+        tree = parser.edit(offset + 2, 1, '')
+        self.assertSameAsFullParse(parser, tree)
+
 
 class TestCallStack:
     def __init__(self):
@@ -317,6 +1354,395 @@ END.  {Part12}
         self.assertEqual(ar['b'], 25)
         self.assertAlmostEqual(ar['y'], float(20) / 7 + 3.14)  # 5.9971...
 
+    def test_variables_of_enclosing_scopes(self):
+        text = """\
+PROGRAM Scopes;
+VAR x, y : INTEGER;
+
+PROCEDURE Outer(a : INTEGER);
+VAR k : INTEGER;
+   PROCEDURE Inner(b : INTEGER);
+   BEGIN
+      k := a + b;
+      y := -k * 2
+   END;
+BEGIN
+   k := 0;
+   x := a;
+   Inner(a + 1)
+END;
+
+BEGIN
+   Outer(10)
+END.
+"""
+        interpreter = self.makeInterpreter(text)
+        interpreter.interpret()
+
+        call = interpreter.tree.block.compound_statement.children[0]
+        self.assertEqual(call.proc_symbol.frame_size, 2)
+        ar = interpreter.call_stack.peek()
+        self.assertEqual(ar.name, 'Inner')
+        self.assertEqual(ar.members, {'b': 11})
+        self.assertEqual(ar.enclosing.members, {'a': 10, 'k': 21})
+        self.assertEqual(ar.enclosing.enclosing.members, {'x': 10, 'y': -42})
+
+    def test_call_stack_is_not_formatted_without_logging(self):
+        class UnprintableCallStack(TestCallStack):
+            def __str__(self):
+                raise AssertionError('call stack formatted')
+
+        interpreter = self.makeInterpreter("""\
+PROGRAM Quiet;
+PROCEDURE P(a : INTEGER);
+BEGIN END;
+BEGIN P(1) END.
+""")
+        interpreter.call_stack = UnprintableCallStack()
+        interpreter.interpret()
+        self.assertEqual(interpreter.call_stack.peek().name, 'P')
+
+
+class LazyInterpreterTestCase(InterpreterTestCase):
+    def makeInterpreter(self, text):
+        from spi import Lexer, LazyParser, SemanticAnalyzer, Interpreter
+        lexer = Lexer(text)
+        parser = LazyParser(lexer)
+        tree = parser.parse()
+
+        semantic_analyzer = SemanticAnalyzer()
+        semantic_analyzer.visit(tree)
+
+        interpreter = Interpreter(tree)
+        interpreter.call_stack = TestCallStack()
+        return interpreter
+
+    text = """\
+PROGRAM Lazy;
+VAR x : INTEGER;
+
+PROCEDURE Used(a : INTEGER);
+VAR y : INTEGER;
+   PROCEDURE Inner(b : INTEGER);
+   VAR c : INTEGER;
+   BEGIN c := b * 2 END;
+BEGIN
+   BEGIN y := a + 1; Inner(y) END
+END;
+
+PROCEDURE Unused;
+BEGIN
+   x := 1 * ;
+END;
+
+BEGIN
+   Used(21)
+END.
+"""
+
+    def test_blocks_are_parsed_on_first_call(self):
+        from spi import LazyBlock
+        interpreter = self.makeInterpreter(self.text)
+        used, unused = interpreter.tree.block.declarations[1:]
+        self.assertIsInstance(used.block_node, LazyBlock)
+        self.assertIsNone(used.block_node.block)
+
+        interpreter.interpret()
+        ar = interpreter.call_stack.peek()
+        self.assertEqual(ar.name, 'Inner')
+        self.assertEqual(ar['c'], 44)
+        inner = used.block_node.block.declarations[1]
+        self.assertIsInstance(inner.block_node, LazyBlock)
+        self.assertIsNotNone(inner.block_node.block)
+        self.assertIsNone(unused.block_node.block)
+
+    def test_syntax_error_reported_on_call(self):
+        from spi import ParserError
+        interpreter = self.makeInterpreter(
+            self.text.replace('Used(21)', 'Used(21); Unused()')
+        )
+        with self.assertRaises(ParserError) as cm:
+            interpreter.interpret()
+        self.assertEqual(cm.exception.token.value, ';')
+        self.assertEqual(cm.exception.token.position(), (15, 13))
+
+    def test_parse_with_recovery(self):
+        from spi import LazyParser, Lexer
+        text = self.text.replace('PROCEDURE Unused;', 'PROCEDURE Unused(;')
+        text = text.replace('Used(21)', 'x := 1 + ;\n   Used(21) 7')
+        tree, errors = LazyParser(Lexer(text)).parse_with_recovery()
+        self.assertEqual(
+            [error.token.position() for error in errors],
+            [(13, 18), (19, 13), (20, 13)],
+        )
+        self.assertEqual(
+            [d.proc_name for d in tree.block.declarations[1:]], ['Used'],
+        )
+
+    def test_unbalanced_block(self):
+        from spi import LazyParser, Lexer, ParserError
+        parser = LazyParser(Lexer(
+            'PROGRAM Test; PROCEDURE P; BEGIN BEGIN END; BEGIN END.'
+        ))
+        with self.assertRaises(ParserError) as cm:
+            parser.parse()
+        self.assertEqual(cm.exception.token.type.value, 'EOF')
+
+    def test_blocks_are_analyzed_by_the_same_analyzer(self):
+        from spi import (
+            ErrorCode, Interpreter, LazyParser, Lexer, SemanticError,
+            TypeChecker,
+        )
+        tree = LazyParser(Lexer(self.text.replace(
+            'VAR c : INTEGER;', 'VAR c : REAL;'
+        ).replace('Used(21)', 'x := 2; Used(x)'))).parse()
+        TypeChecker().visit(tree)
+        interpreter = Interpreter(tree)
+        interpreter.call_stack = TestCallStack()
+        interpreter.interpret()
+        ar = interpreter.call_stack.peek()
+        self.assertEqual(ar['c'], 6)
+        used = tree.block.declarations[1]
+        assign = used.block_node.block.compound_statement.children[0]
+        self.assertEqual(assign.children[0].right.eval_type, 'INTEGER')
+
+        tree = LazyParser(Lexer(self.text.replace(
+            'VAR y : INTEGER;', 'VAR y : REAL;'
+        ))).parse()
+        TypeChecker().visit(tree)
+        with self.assertRaises(SemanticError) as cm:
+            Interpreter(tree).interpret()
+        self.assertEqual(cm.exception.error_code, ErrorCode.TYPE_MISMATCH)
+        self.assertEqual(cm.exception.token.position(), (10, 28))
+
+
+class FlatInterpreterTestCase(InterpreterTestCase):
+    def makeInterpreter(self, text):
+        from spi import Lexer, Parser, SemanticAnalyzer, Interpreter, flatten
+        lexer = Lexer(text)
+        parser = Parser(lexer)
+        tree = flatten(parser.parse()).root()
+
+        semantic_analyzer = SemanticAnalyzer()
+        semantic_analyzer.visit(tree)
+
+        interpreter = Interpreter(tree)
+        interpreter.call_stack = TestCallStack()
+        return interpreter
+
+    text = """\
+PROGRAM Flat;
+VAR x : INTEGER; y : REAL;
+
+PROCEDURE P(a : INTEGER; b : REAL);
+BEGIN
+   y := -(a + 2) * b / 2.5;
+   x := a DIV 3
+END;
+
+BEGIN
+   P(7, 0.5)
+END.
+"""
+
+    def test_same_tree_as_parser(self):
+        from spi import Lexer, Parser, flatten
+        tree = Parser(Lexer(self.text)).parse()
+        flat = flatten(tree)
+        self.assertEqual(dump_ast(flat.root()), dump_ast(tree))
+        self.assertEqual(flat.root().block.declarations[2].proc_name, 'P')
+
+    def test_flatten_lazy_tree(self):
+        from spi import LazyParser, Parser, RegexLexer, flatten
+        buffer = RegexLexer(self.text).tokenize()
+        tree = LazyParser(buffer.reader()).parse()
+        expected = Parser(buffer.reader()).parse()
+        self.assertEqual(dump_ast(flatten(tree).root()), dump_ast(expected))
+
+    def test_frombuffer(self):
+        import mmap
+        import tempfile
+        from spi import Lexer, LineIndex, Parser, FlatTree, flatten
+        flat = flatten(Parser(Lexer(self.text)).parse())
+        with tempfile.TemporaryFile() as f:
+            f.write(flat.tobytes())
+            f.flush()
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            tree = FlatTree.frombuffer(data, LineIndex(self.text))
+            self.assertEqual(dump_ast(tree.root()), dump_ast(flat.root()))
+            del tree
+            data.close()
+
+    def test_pickle_analyzed_tree(self):
+        import pickle
+        from spi import Lexer, Parser, SemanticAnalyzer, Interpreter, flatten
+        tree = flatten(Parser(Lexer(self.text)).parse()).root()
+        SemanticAnalyzer().visit(tree)
+
+        interpreter = Interpreter(pickle.loads(pickle.dumps(tree)))
+        interpreter.call_stack = TestCallStack()
+        interpreter.interpret()
+        # P assigns the variables of the program
+        ar = interpreter.call_stack.peek().enclosing
+        self.assertEqual(ar['x'], 2)
+        self.assertAlmostEqual(ar['y'], -1.8)
+
+
+class HashConsingInterpreterTestCase(InterpreterTestCase):
+    def makeInterpreter(self, text):
+        from spi import Lexer, HashConsingParser, SemanticAnalyzer
+        from spi import Interpreter
+        lexer = Lexer(text)
+        parser = HashConsingParser(lexer)
+        tree = parser.parse()
+
+        semantic_analyzer = SemanticAnalyzer()
+        semantic_analyzer.visit(tree)
+
+        interpreter = Interpreter(tree)
+        interpreter.call_stack = TestCallStack()
+        return interpreter
+
+
+class TypeCheckedInterpreterTestCase(InterpreterTestCase):
+    def makeInterpreter(self, text):
+        from spi import Lexer, Parser, TypeChecker, Interpreter
+        lexer = Lexer(text)
+        parser = Parser(lexer)
+        tree = parser.parse()
+
+        type_checker = TypeChecker()
+        type_checker.visit(tree)
+
+        interpreter = Interpreter(tree)
+        interpreter.call_stack = TestCallStack()
+        return interpreter
+
+
+class CacheTestCase(unittest.TestCase):
+    text = """\
+program Main;
+var x : integer;
+
+procedure Alpha(a : integer; b : integer);
+var x : integer;
+begin
+   x := (a + b ) * 2;
+end;
+
+begin { Main }
+   x := 3;
+   Alpha(3 + 5, 7);
+end.  { Main }
+"""
+
+    def setUp(self):
+        import os
+        import tempfile
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'main.pas')
+        self.write(self.text)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write(self, text):
+        with open(self.path, 'w') as f:
+            f.write(text)
+
+    def analyze(self, text):
+        from spi import Lexer, Parser, SemanticAnalyzer
+        tree = Parser(Lexer(text)).parse()
+        SemanticAnalyzer().visit(tree)
+        return tree
+
+    def test_cache_hit(self):
+        from spi import (
+            Interpreter, cache_key, load_cached_tree, store_cached_tree,
+        )
+        key = cache_key(self.path)
+        self.assertIsNone(load_cached_tree(self.path, key))
+        store_cached_tree(self.path, key, self.analyze(self.text))
+        tree = load_cached_tree(self.path, key)
+        self.assertIsNotNone(tree)
+
+        interpreter = Interpreter(tree)
+        interpreter.call_stack = TestCallStack()
+        interpreter.interpret()
+        ar = interpreter.call_stack.peek()
+        self.assertEqual(ar['x'], 30)
+
+        # tokens are linked to a new line index of the source file
+        var_node = tree.block.compound_statement.children[0].left
+        self.assertEqual((var_node.token.lineno, var_node.token.column), (11, 4))
+
+    def test_source_read_in_chunks(self):
+        from unittest import mock
+        from spi import cache_key, load_cached_tree, store_cached_tree
+        key = cache_key(self.path)
+        store_cached_tree(self.path, key, self.analyze(self.text))
+        with mock.patch('spi._CACHE_CHUNK_SIZE', 7):
+            self.assertEqual(cache_key(self.path), key)
+            tree = load_cached_tree(self.path, key)
+        var_node = tree.block.compound_statement.children[1].actual_params[1]
+        self.assertEqual(var_node.token.position(), (12, 17))
+
+    def test_cache_miss_on_changed_source(self):
+        from spi import cache_key, load_cached_tree, store_cached_tree
+        key = cache_key(self.path)
+        store_cached_tree(self.path, key, self.analyze(self.text))
+        self.write(self.text.replace('x := 3', 'x := 4'))
+        self.assertIsNone(load_cached_tree(self.path, cache_key(self.path)))
+
+    def test_cache_miss_on_other_analyzer(self):
+        from spi import (
+            TypeChecker, cache_key, load_cached_tree, store_cached_tree,
+        )
+        key = cache_key(self.path)
+        store_cached_tree(self.path, key, self.analyze(self.text))
+        key = cache_key(self.path, TypeChecker)
+        self.assertIsNone(load_cached_tree(self.path, key))
+
+    def test_lazy_tree_without_source(self):
+        from spi import (
+            Interpreter, LazyParser, Lexer, SemanticAnalyzer, cache_key,
+            load_cached_tree, store_cached_tree,
+        )
+        tree = LazyParser(Lexer(self.text)).parse()
+        SemanticAnalyzer().visit(tree)
+        key = cache_key(self.path)
+        store_cached_tree(self.path, key, tree)
+        tree = load_cached_tree(self.path, key)
+        lazy_block = tree.block.declarations[1].block_node
+        self.assertIsNone(lazy_block.buffer.text)
+
+        interpreter = Interpreter(tree)
+        interpreter.call_stack = TestCallStack()
+        interpreter.interpret()
+        ar = interpreter.call_stack.peek()
+        self.assertEqual(ar['x'], 30)
+
+    def test_unpicklable_tree(self):
+        import os
+        from spi import (
+            _cache_path, cache_key, load_cached_tree, store_cached_tree,
+        )
+        key = cache_key(self.path)
+        store_cached_tree(self.path, key, (x for x in ()))
+        self.assertIsNone(load_cached_tree(self.path, key))
+        cache_dir = os.path.dirname(_cache_path(self.path))
+        self.assertEqual(os.listdir(cache_dir), [])
+
+    def test_corrupted_cache(self):
+        from spi import (
+            _cache_path, cache_key, load_cached_tree, store_cached_tree,
+        )
+        key = cache_key(self.path)
+        store_cached_tree(self.path, key, self.analyze(self.text))
+        with open(_cache_path(self.path), 'r+b') as f:
+            f.seek(-10, 2)
+            f.truncate()
+        self.assertIsNone(load_cached_tree(self.path, key))
 
 if __name__ == '__main__':
     unittest.main()